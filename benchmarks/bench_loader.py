@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import os
+import time
+
+from common import peak_rss_mb, use_source_tree, write_results
+
+use_source_tree()
+
+from load_data import BATCH_SIZE, load_json_to_db
+
+# Бенчмарк загрузчика: строк в секунду и пиковый RSS процесса.
+# Таблицы должны быть созданы заранее (scripts/__init__db.py), DATABASE_URL - локальный Postgres:
+#   python benchmarks/generate_data.py --videos 5000 --output data/bench_videos.json
+#   python benchmarks/bench_loader.py data/bench_videos.json --batch-size 20000
+# Повторный полный прогон по тем же данным пишет 0 новых снапшотов: для сравнения перед ним
+# очищают таблицы или меряют --incremental отдельно.
+
+
+async def run_loader_benchmark(json_file: str, batch_size: int, incremental: bool) -> dict:
+    rss_before = peak_rss_mb()
+    started = time.monotonic()
+    stats = await load_json_to_db(json_file, batch_size=batch_size, incremental=incremental, resume=False)
+    elapsed = time.monotonic() - started
+    
+    return {
+        'videos': stats['videos_seen'],
+        'videos_written': stats['videos_inserted'],
+        'snapshots_written': stats['snapshots_inserted'],
+        'snapshots_skipped': stats['snapshots_skipped'],
+        'rows_sent': stats['rows_sent'],
+        'elapsed_sec': round(elapsed, 3),
+        'rows_per_sec': round(stats['rows_sent'] / elapsed, 1) if elapsed else 0.0,
+        'file_mb': round(os.path.getsize(json_file) / 1024 / 1024, 1),
+        'peak_rss_mb_before': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузки videos.json в PostgreSQL")
+    parser.add_argument("json_file", nargs="?", default="data/bench_videos.json")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+    
+    results = asyncio.run(run_loader_benchmark(args.json_file, args.batch_size, args.incremental))
+    write_results('loader', vars(args), results, args.output)
@@ -0,0 +1,105 @@
+import argparse
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from common import StubLLM, load_questions, summarize, use_source_tree, use_stub_llm, write_results
+
+# Бенчмарк запросов: корпус вопросов проходит через LLMSQLGenerator (LLM - локальная детерминированная
+# заглушка) и Database.execute_query на локальном Postgres; по каждому этапу считаются p50/p95/p99.
+#   python benchmarks/bench_queries.py --rounds 20 --concurrency 10 --llm-latency 0.3
+# Кэши SQL и результатов по умолчанию выключены, чтобы каждый раунд проходил все этапы;
+# включаются обычными переменными окружения (SQL_CACHE_SIZE, RESULT_CACHE_SIZE).
+use_stub_llm()
+os.environ.setdefault("SQL_CACHE_SIZE", "0")
+os.environ.setdefault("SQL_CACHE_PATH", "")
+os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+use_source_tree()
+
+from config import settings
+from database import Database
+from llm_sql_generator import LLMSQLGenerator
+from metrics import registry, request_stages
+
+
+async def run_question(generator: LLMSQLGenerator, db: Database, question: str, fast_path: bool,
+                       samples: Dict[str, List[float]]):
+    """Один вопрос: план, затем выполнение; этапы из метрик плюс итоговые plan/execute/total"""
+    with request_stages() as stages:
+        started = time.perf_counter()
+        plan = await generator.aplan_query(question, fast_path=fast_path)
+        planned = time.perf_counter()
+        await db.execute_query(plan.sql, *plan.params)
+        finished = time.perf_counter()
+    
+    for stage, seconds in stages:
+        samples[stage].append(seconds)
+    samples['plan'].append(planned - started)
+    samples['execute'].append(finished - planned)
+    samples['total'].append(finished - started)
+
+
+async def run_query_benchmark(questions: List[str], rounds: int, concurrency: int,
+                              llm_latency: float, fast_path: bool) -> dict:
+    generator = LLMSQLGenerator(provider="openai")
+    db = Database(settings.DATABASE_URL)
+    stub = StubLLM(generator, llm_latency)
+    stub_runner = await stub.start()
+    await db.connect()
+    
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    queue = iter([question for _ in range(rounds) for question in questions])
+    
+    async def worker():
+        for question in queue:
+            try:
+                await run_question(generator, db, question, fast_path, samples)
+            except Exception as e:
+                errors[f"{type(e).__name__}: {str(e)[:80]}"] += 1
+    
+    try:
+        # Прогрев: соединения пула, подготовленные шаблоны, клиент SDK
+        await run_question(generator, db, questions[0], fast_path, defaultdict(list))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await generator.aclose()
+        await db.close()
+        await stub_runner.cleanup()
+    
+    total = len(questions) * rounds
+    return {
+        'questions': len(questions),
+        'requests': total,
+        'errors': sum(errors.values()),
+        'error_samples': dict(errors),
+        'elapsed_sec': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 1) if elapsed else 0.0,
+        'llm_calls': stub.calls,
+        'plans': {dict(labels)['source']: value for (name, labels), value in registry.counters.items()
+                  if name == 'plans'},
+        'stages': {stage: summarize(values) for stage, values in sorted(samples.items())},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов ответа на вопросы через заглушку LLM и Postgres")
+    parser.add_argument("--questions", default=None, help="файл корпуса (по умолчанию benchmarks/questions.txt)")
+    parser.add_argument("--rounds", type=int, default=10, help="сколько раз прогнать корпус")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка ответа заглушки LLM, секунды")
+    parser.add_argument("--fast-path", action="store_true",
+                        help="разрешить правила быстрого пути (по умолчанию каждый вопрос идет в LLM)")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+    
+    corpus = load_questions(args.questions) if args.questions else load_questions()
+    results = asyncio.run(run_query_benchmark(
+        corpus, args.rounds, args.concurrency, args.llm_latency, args.fast_path
+    ))
+    params = dict(vars(args), sql_cache_size=settings.SQL_CACHE_SIZE, result_cache_size=settings.RESULT_CACHE_SIZE)
+    write_results('queries', params, results, args.output)
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from common import ROOT_DIR, summarize, write_results
+
+# Холодный старт бота: каждый прогон - новый процесс python, как у новой реплики контейнера.
+#   python benchmarks/bench_startup.py --runs 10
+#   python benchmarks/bench_startup.py --runs 5 --ready   # плюс startup(): нужны БД и настройки из .env
+# Меряются импорт модуля bot, create_app() и (с --ready) startup() до готовности принимать апдейты;
+# в результат попадает и список загруженных SDK: лишние провайдеры не должны импортироваться.
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import bot
+imported = time.perf_counter() - started
+started = time.perf_counter()
+bot.create_app()
+built = time.perf_counter() - started
+result = {'import': imported, 'create_app': built, 'module_import': bot.IMPORT_SECONDS}
+if READY:
+    async def ready():
+        started = time.perf_counter()
+        await bot.startup()
+        result['startup'] = time.perf_counter() - started
+        result['ready'] = time.perf_counter() - bot.STARTED_AT
+        await bot.shutdown()
+    asyncio.run(ready())
+result['modules'] = [name for name in ('openai', 'anthropic', 'groq', 'httpx', 'numpy') if name in sys.modules]
+print(json.dumps(result))
+"""
+
+
+def run_once(ready: bool) -> Dict:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+    env["LOG_LEVEL"] = env.get("BENCH_LOG_LEVEL", "WARNING")
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', f"READY = {ready}\n{CHILD}"],
+        cwd=os.path.join(ROOT_DIR, 'src'), env=env, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - started
+    return result
+
+
+def run_startup_benchmark(runs: int, ready: bool) -> dict:
+    samples: Dict[str, List[float]] = {}
+    modules = set()
+    for _ in range(runs):
+        result = run_once(ready)
+        modules.update(result.pop('modules'))
+        for stage, seconds in result.items():
+            samples.setdefault(stage, []).append(seconds)
+    return {
+        'runs': runs,
+        'sdk_modules_loaded': sorted(modules),
+        'stages': {stage: summarize(values) for stage, values in samples.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота: импорт и готовность")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--ready", action="store_true", help="выполнять startup() (подключение к БД и API)")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+    
+    results = run_startup_benchmark(args.runs, args.ready)
+    params = dict(vars(args), llm_provider=os.getenv("LLM_PROVIDER", "openai"))
+    write_results('startup', params, results, args.output)
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+QUESTIONS_PATH = os.path.join(BENCHMARKS_DIR, 'questions.txt')
+
+# Порты локальных заглушек: LLM (OpenAI-совместимый API) и Bot API
+LLM_STUB_PORT = int(os.getenv("BENCH_LLM_STUB_PORT", "8091"))
+BOT_API_STUB_PORT = int(os.getenv("BENCH_BOT_API_PORT", "8092"))
+
+
+def use_source_tree():
+    """Модули бота (src/) и скриптов (scripts/) импортируются как в самом репозитории"""
+    for path in (os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'scripts')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def use_stub_llm():
+    """Настройки LLM на локальную заглушку; вызывать до импорта config"""
+    os.environ.update({
+        "LLM_PROVIDER": "openai",
+        "LLM_PROVIDERS": "openai",
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{LLM_STUB_PORT}/v1",
+    })
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> List[str]:
+    """Корпус вопросов: по одному на строку, строки с # - комментарии"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 и среднее в миллисекундах по замерам в секундах"""
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса (ru_maxrss в Linux - килобайты, в macOS - байты)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(name: str, params: Dict, results: Dict, output: Optional[str] = None) -> str:
+    """JSON с параметрами, окружением и результатами прогона; по умолчанию в benchmarks/results/"""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    report = {
+        'benchmark': name,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    print(f"📄 Результаты: {output}")
+    return output
+
+
+class StubLLM:
+    """Детерминированная заглушка OpenAI-совместимого API
+    
+    Вопрос достается из промпта, а SQL для него строит резервная логика генератора:
+    один и тот же вопрос всегда получает один и тот же SQL, задержка фиксированная.
+    """
+    
+    QUESTION_PATTERN = re.compile(r'Пользовательский запрос: "(.*)"')
+    
+    def __init__(self, generator, latency: float = 0.0):
+        self.generator = generator
+        self.latency = latency
+        self.calls = 0
+    
+    def sql_for(self, prompt: str) -> str:
+        match = self.QUESTION_PATTERN.search(prompt)
+        question = match.group(1) if match else ''
+        return self.generator._fallback_sql_generation(question, self.generator._extract_date_range(question))
+    
+    async def chat_completions(self, request):
+        self.calls += 1
+        payload = await request.json()
+        prompt = '\n'.join(
+            part['text'] if isinstance(part, dict) else part
+            for message in payload.get('messages', [])
+            for part in (message['content'] if isinstance(message['content'], list) else [message['content']])
+        )
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({
+            'id': f'stub-{self.calls}', 'object': 'chat.completion', 'created': int(time.time()), 'model': 'stub',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.sql_for(prompt)},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 20, 'total_tokens': len(prompt) // 4 + 20},
+        })
+    
+    async def start(self):
+        """Запуск на LLM_STUB_PORT; возвращает runner для cleanup()"""
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', LLM_STUB_PORT).start()
+        return runner
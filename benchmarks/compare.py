@@ -0,0 +1,47 @@
+import argparse
+import json
+from typing import Any, Dict
+
+# Сравнение двух прогонов одного бенчмарка:
+#   python benchmarks/compare.py benchmarks/results/queries-A.json benchmarks/results/queries-B.json
+
+
+def flatten(value: Any, prefix: str = '') -> Dict[str, float]:
+    """Числовые листья результатов: {'stages.llm_call.p95_ms': 12.3, ...}"""
+    if isinstance(value, dict):
+        items = {}
+        for key, child in value.items():
+            items.update(flatten(child, f'{prefix}.{key}' if prefix else str(key)))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(before: dict, after: dict) -> list:
+    old = flatten(before['results'])
+    new = flatten(after['results'])
+    rows = []
+    for key in sorted(old.keys() | new.keys()):
+        a, b = old.get(key), new.get(key)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ''
+        rows.append((key, a, b, change))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение результатов двух прогонов бенчмарка")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    
+    with open(args.before, encoding='utf-8') as f:
+        before = json.load(f)
+    with open(args.after, encoding='utf-8') as f:
+        after = json.load(f)
+    if before['benchmark'] != after['benchmark']:
+        print(f"⚠️ Разные бенчмарки: {before['benchmark']} и {after['benchmark']}")
+    
+    print(f"{before.get('git_revision')} -> {after.get('git_revision')}")
+    for key, a, b, change in compare(before, after):
+        print(f"{key:60} {str(a):>14} {str(b):>14} {change:>9}")
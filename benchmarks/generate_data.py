@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator
+
+# Синтетический videos.json в формате scripts/load_data.py:
+#   python benchmarks/generate_data.py --creators 100 --videos 5000 --days 10 --output data/bench_videos.json
+# Один и тот же seed дает один и тот же файл, поэтому прогоны загрузчика и запросов сравнимы.
+
+COUNTERS = ('views', 'likes', 'comments', 'reports')
+
+
+def generate_video(rng: random.Random, video_id: int, creators: int, start: datetime, days: int) -> Dict[str, Any]:
+    """Видео с почасовыми снапшотами от публикации до конца периода"""
+    end = start + timedelta(days=days)
+    # Часть видео опубликована до начала периода, остальные - равномерно внутри него
+    published = start + timedelta(hours=rng.randint(-48, days * 24 - 1))
+    first_snapshot = max(published, start).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    
+    # Популярность видео: почасовой прирост просмотров с тяжелым хвостом
+    views_rate = rng.paretovariate(1.5) * 20
+    rates = {
+        'views': views_rate,
+        'likes': views_rate * rng.uniform(0.02, 0.08),
+        'comments': views_rate * rng.uniform(0.001, 0.01),
+        'reports': views_rate * rng.uniform(0.0, 0.0005),
+    }
+    totals = {name: 0 for name in COUNTERS}
+    
+    snapshots = []
+    moment = first_snapshot
+    while moment <= end:
+        deltas = {name: int(rng.expovariate(1 / rates[name])) if rates[name] > 0 else 0 for name in COUNTERS}
+        snapshot = {}
+        for name in COUNTERS:
+            totals[name] += deltas[name]
+            snapshot[f'{name}_count'] = totals[name]
+        for name in COUNTERS:
+            snapshot[f'delta_{name}_count'] = deltas[name]
+        snapshot['created_at'] = moment.isoformat()
+        snapshot['updated_at'] = moment.isoformat()
+        snapshots.append(snapshot)
+        moment += timedelta(hours=1)
+    
+    last_update = snapshots[-1]['created_at'] if snapshots else published.isoformat()
+    video = {
+        'id': video_id,
+        'creator_id': rng.randint(1, creators),
+        'video_created_at': published.isoformat(),
+    }
+    video.update({f'{name}_count': totals[name] for name in COUNTERS})
+    video['created_at'] = published.isoformat()
+    video['updated_at'] = last_update
+    video['snapshots'] = snapshots
+    return video
+
+
+def generate_videos(creators: int, videos: int, days: int, start: datetime, seed: int) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    for video_id in range(1, videos + 1):
+        yield generate_video(rng, video_id, creators, start, days)
+
+
+def write_videos_json(path: str, creators: int, videos: int, days: int, start: datetime, seed: int) -> Dict[str, int]:
+    """Потоковая запись JSON-массива: в памяти всегда одно видео"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    
+    snapshots = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for index, video in enumerate(generate_videos(creators, videos, days, start, seed)):
+            if index:
+                f.write(',\n')
+            json.dump(video, f, ensure_ascii=False)
+            snapshots += len(video['snapshots'])
+        f.write('\n]\n')
+    return {'videos': videos, 'snapshots': snapshots, 'bytes': os.path.getsize(path)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генерация синтетического videos.json для бенчмарков")
+    parser.add_argument("--creators", type=int, default=50)
+    parser.add_argument("--videos", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=10, help="длина периода с почасовыми снапшотами")
+    parser.add_argument("--start", default="2025-11-01", help="начало периода (совпадает с датами корпуса вопросов)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="data/bench_videos.json")
+    args = parser.parse_args()
+    
+    start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+    started = time.monotonic()
+    stats = write_videos_json(args.output, args.creators, args.videos, args.days, start, args.seed)
+    print(f"✅ {args.output}: {stats['videos']} видео, {stats['snapshots']} снапшотов, "
+          f"{stats['bytes'] / 1024 / 1024:.1f} МБ за {time.monotonic() - started:.1f} с")
@@ -0,0 +1,106 @@
+import argparse
+import asyncio
+import os
+import time
+from typing import List
+
+from common import BOT_API_STUB_PORT, StubLLM, load_questions, summarize, use_source_tree, use_stub_llm, write_results
+
+# Повтор Telegram-апдейтов прямо через диспетчер бота, без сети до Telegram и без вебхука:
+# ответы бота уходят в заглушку Bot API, SQL - в заглушку LLM, запросы - в локальный Postgres.
+#   python benchmarks/replay_updates.py --updates 2000 --concurrency 50 --users 500
+use_stub_llm()
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{BOT_API_STUB_PORT}"
+os.environ.setdefault("METRICS_PORT", "0")
+use_source_tree()
+
+from aiohttp import web
+from aiogram.types import Update
+
+import bot as bot_app
+from metrics import registry
+from webhook_load_test import FakeBotAPI, make_update
+
+
+async def run_replay(questions: List[str], updates: int, concurrency: int, users: int,
+                     lines_per_message: int, llm_latency: float) -> dict:
+    bot_app.create_app()
+    fake_api = FakeBotAPI()
+    fake_api.expected = updates
+    api = web.Application()
+    api.router.add_route('POST', '/bot{token}/{method}', fake_api.handle)
+    api_runner = web.AppRunner(api)
+    await api_runner.setup()
+    await web.TCPSite(api_runner, '127.0.0.1', BOT_API_STUB_PORT).start()
+    stub_runner = await StubLLM(bot_app.llm_sql, llm_latency).start()
+    
+    def message_text(update_id: int) -> str:
+        first = update_id * lines_per_message
+        return '\n'.join(questions[(first + i) % len(questions)] for i in range(lines_per_message))
+    
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(range(updates))
+    
+    async def feeder():
+        nonlocal errors
+        for update_id in queue:
+            payload = make_update(update_id, 1_000_000 + update_id % users, message_text(update_id))
+            update = Update.model_validate(payload, context={'bot': bot_app.bot})
+            started = time.perf_counter()
+            try:
+                await bot_app.dp.feed_update(bot_app.bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    
+    await bot_app.startup()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(feeder() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot_app.shutdown()
+        await stub_runner.cleanup()
+        await api_runner.cleanup()
+    
+    # Этапы внутри обработчика доступны только как гистограммы реестра: квантили - по границам корзин
+    stage_histograms = {}
+    for (stage, labels), histogram in sorted(registry.histograms.items()):
+        name = stage + ''.join(f'[{value}]' for _, value in labels)
+        stage_histograms[name] = {
+            'count': histogram.count,
+            'p50_le_ms': histogram.quantile(0.50) * 1000,
+            'p95_le_ms': histogram.quantile(0.95) * 1000,
+            'p99_le_ms': histogram.quantile(0.99) * 1000,
+        }
+    
+    return {
+        'updates': updates,
+        'errors': errors,
+        'elapsed_sec': round(elapsed, 3),
+        'updates_per_sec': round(updates / elapsed, 1) if elapsed else 0.0,
+        'replies': fake_api.replies,
+        'api_methods': fake_api.methods,
+        'update_latency': summarize(latencies),
+        'stages': stage_histograms,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Повтор Telegram-апдейтов через диспетчер бота")
+    parser.add_argument("--questions", default=None, help="файл корпуса (по умолчанию benchmarks/questions.txt)")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000, help="сколько разных пользователей имитировать")
+    parser.add_argument("--lines", type=int, default=1, help="вопросов в одном сообщении (>1 - пакетный ответ)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="задержка ответа заглушки LLM, секунды")
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/)")
+    args = parser.parse_args()
+    
+    corpus = load_questions(args.questions) if args.questions else load_questions()
+    results = asyncio.run(run_replay(
+        corpus, args.updates, args.concurrency, args.users, args.lines, args.llm_latency
+    ))
+    write_results('replay', vars(args), results, args.output)
@@ -1,43 +1,61 @@
-import asyncio
-import asyncpg
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-async def init_database():
-    """Создание таблиц в базе данных"""
-    
-    
-    with open('scripts/create_tables.sql', 'r', encoding='utf-8') as f:
-        sql_script = f.read()
-    
-    
-    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
-    
-    try:
-        
-        await conn.execute(sql_script)
-        print("✅ Таблицы успешно созданы!")
-        
-        
-        tables = await conn.fetch("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public'
-        """)
-        
-        print(f"✅ Создано таблиц: {len(tables)}")
-        for table in tables:
-            print(f"  - {table['table_name']}")
-            
-    except Exception as e:
-        print(f"❌ Ошибка: {str(e)}")
-        raise
-    finally:
-        await conn.close()
-
-
-if __name__ == "__main__":
-    asyncio.run(init_database())
\ No newline at end of file
+import argparse
+import asyncio
+import asyncpg
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+async def init_database(partitioned: bool = False):
+    """Создание таблиц в базе данных
+    
+    partitioned: перевести video_snapshots на помесячные секции с BRIN-индексом
+    (для существующей обычной таблицы выполняется миграция данных).
+    """
+    
+    
+    with open('scripts/create_tables.sql', 'r', encoding='utf-8') as f:
+        sql_script = f.read()
+    
+    
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    
+    try:
+        
+        await conn.execute(sql_script)
+        print("✅ Таблицы успешно созданы!")
+        
+        if partitioned:
+            with open('scripts/partition_snapshots.sql', 'r', encoding='utf-8') as f:
+                await conn.execute(f.read())
+            partitions = await conn.fetchval("""
+                SELECT COUNT(*) FROM pg_inherits
+                WHERE inhparent = 'video_snapshots'::regclass
+            """)
+            print(f"✅ video_snapshots секционирована по месяцам, секций: {partitions}")
+        
+        
+        tables = await conn.fetch("""
+            SELECT table_name 
+            FROM information_schema.tables 
+            WHERE table_schema = 'public'
+        """)
+        
+        print(f"✅ Создано таблиц: {len(tables)}")
+        for table in tables:
+            print(f"  - {table['table_name']}")
+            
+    except Exception as e:
+        print(f"❌ Ошибка: {str(e)}")
+        raise
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Создание таблиц в базе данных")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="секционировать video_snapshots по месяцам (с миграцией существующей таблицы)")
+    args = parser.parse_args()
+    asyncio.run(init_database(partitioned=args.partitioned))
\ No newline at end of file
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import web
+
+# Заглушки провайдеров поднимаются локально; адреса и ключи задаются до импорта настроек
+STUB_PORT = int(os.getenv("LLM_STUB_PORT", "8090"))
+STUB_URL = f"http://127.0.0.1:{STUB_PORT}"
+os.environ.update({
+    "OPENAI_API_KEY": "stub", "GROQ_API_KEY": "stub", "ANTHROPIC_API_KEY": "stub",
+    "OPENAI_BASE_URL": f"{STUB_URL}/v1",
+    "GROQ_BASE_URL": STUB_URL,
+    "ANTHROPIC_BASE_URL": STUB_URL,
+    "OLLAMA_URL": f"{STUB_URL}/api/generate",
+    "LLM_PROVIDERS": "openai,groq,anthropic,ollama",
+    "LLM_HEDGE_DELAY": "0.2",
+    "LLM_BREAKER_FAILURES": "3",
+})
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from llm_sql_generator import LLMSQLGenerator
+
+STUB_SQL = "SELECT COUNT(*) FROM videos;"
+UNSAFE_SQL = "DELETE FROM videos;"
+
+
+class ProviderStubs:
+    """Один aiohttp-сервер с API всех провайдеров; задержка и поведение настраиваются по провайдеру"""
+    
+    def __init__(self):
+        self.behaviour = {}
+        self.calls = {}
+    
+    def configure(self, **behaviour):
+        """provider=(задержка в секундах, 'ok' | 'error' | 'garbage' | 'unsafe_once')"""
+        self.behaviour = behaviour
+        self.calls = {provider: 0 for provider in ('openai', 'groq', 'anthropic', 'ollama')}
+    
+    async def _reply(self, provider: str, payload):
+        self.calls[provider] += 1
+        delay, mode = self.behaviour.get(provider, (0, 'ok'))
+        await asyncio.sleep(delay)
+        if mode == 'error':
+            # 400, а не 500: SDK не повторяет такой запрос сам
+            return web.json_response({'error': {'message': 'stub failure', 'type': 'invalid_request_error'}}, status=400)
+        if mode == 'unsafe_once':
+            # Первый ответ не проходит проверку SQL, исправленный приходит на повтор с ошибкой
+            return web.json_response(payload(UNSAFE_SQL if self.calls[provider] == 1 else STUB_SQL))
+        return web.json_response(payload(STUB_SQL if mode == 'ok' else 'Извините, не могу помочь'))
+    
+    @staticmethod
+    def _chat_completion(text: str) -> dict:
+        return {
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15},
+        }
+    
+    async def openai(self, request: web.Request) -> web.Response:
+        return await self._reply('openai', self._chat_completion)
+    
+    async def groq(self, request: web.Request) -> web.Response:
+        return await self._reply('groq', self._chat_completion)
+    
+    async def anthropic(self, request: web.Request) -> web.Response:
+        return await self._reply('anthropic', lambda text: {
+            'id': 'stub', 'type': 'message', 'role': 'assistant', 'model': 'stub',
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn', 'stop_sequence': None,
+            'usage': {'input_tokens': 10, 'output_tokens': 5},
+        })
+    
+    async def ollama(self, request: web.Request) -> web.Response:
+        return await self._reply('ollama', lambda text: {'response': text, 'prompt_eval_count': 10})
+    
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.openai)
+        app.router.add_post('/openai/v1/chat/completions', self.groq)
+        app.router.add_post('/v1/messages', self.anthropic)
+        app.router.add_post('/api/generate', self.ollama)
+        return app
+
+
+async def run_scenario(stubs: ProviderStubs, name: str, behaviour: dict, expected_provider: str,
+                       max_seconds: float, requests: int = 1) -> bool:
+    stubs.configure(**behaviour)
+    generator = LLMSQLGenerator(provider="openai")
+    try:
+        started = time.monotonic()
+        for _ in range(requests):
+            provider, sql = await generator.router.route("Сколько всего видео есть в системе?")
+        elapsed = time.monotonic() - started
+    finally:
+        await generator.aclose()
+    
+    ok = provider == expected_provider and sql.rstrip(';') == STUB_SQL.rstrip(';') and elapsed <= max_seconds
+    print(f"{'✅' if ok else '❌'} {name}: {provider} за {elapsed:.2f}s, вызовы {stubs.calls}")
+    print(f"   {generator.router.snapshot()}")
+    return ok
+
+
+async def run_cooldown_scenario(stubs: ProviderStubs) -> bool:
+    """Единственный провайдер отключается после 3 ошибок и до конца cooldown не получает запросов"""
+    stubs.configure(openai=(0, 'error'))
+    generator = LLMSQLGenerator(provider="openai")
+    generator.router.providers = ['openai']
+    failures = 0
+    try:
+        for attempt in range(6):
+            if attempt == 3:
+                # Провайдер уже исправен, но автомат еще в cooldown
+                stubs.configure()
+            try:
+                await generator.router.route("Сколько всего видео есть в системе?")
+            except RuntimeError:
+                failures += 1
+    finally:
+        await generator.aclose()
+    
+    ok = failures == 6 and stubs.calls['openai'] == 0
+    print(f"{'✅' if ok else '❌'} отключенный провайдер не вызывается в cooldown: "
+          f"отказов {failures} из 6, вызовы после отключения {stubs.calls}")
+    return ok
+
+
+async def check_llm_router() -> bool:
+    stubs = ProviderStubs()
+    runner = web.AppRunner(stubs.app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', STUB_PORT).start()
+    
+    try:
+        results = [
+            await run_scenario(stubs, "основной провайдер отвечает быстро", {}, 'openai', 1),
+            await run_scenario(stubs, "медленный основной - хедж во второй",
+                               {'openai': (3, 'ok')}, 'groq', 1.5),
+            await run_scenario(stubs, "ошибка основного - сразу второй",
+                               {'openai': (0, 'error')}, 'groq', 1),
+            await run_scenario(stubs, "не-SQL от основного не принимается",
+                               {'openai': (0, 'garbage')}, 'groq', 1),
+            await run_scenario(stubs, "отклоненный SQL исправляется повтором у того же провайдера",
+                               {'openai': (0, 'unsafe_once')}, 'openai', 1),
+            await run_scenario(stubs, "после 3 ошибок подряд основной отключается",
+                               {'openai': (0, 'error')}, 'groq', 5, requests=6),
+        ]
+        # В последнем сценарии отключенный openai получил только первые 3 запроса
+        breaker_ok = stubs.calls['openai'] == 3
+        print(f"{'✅' if breaker_ok else '❌'} circuit breaker: openai вызван {stubs.calls['openai']} раз из 6")
+        cooldown_ok = await run_cooldown_scenario(stubs)
+        return all(results) and breaker_ok and cooldown_ok
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(check_llm_router()) else 1)
@@ -0,0 +1,67 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sql_validator import SQLValidationError, SQLValidator
+
+ALLOWED_TABLES = ['videos', 'video_snapshots', 'daily_video_stats', 'daily_creator_stats']
+
+# Запросы, которые проверка должна пропускать
+ACCEPTED = [
+    "SELECT COUNT(*) FROM videos WHERE updated_at > DATE '2025-11-01'",
+    "SELECT EXTRACT(DAY FROM created_at) FROM video_snapshots",
+    "SELECT a IS DISTINCT FROM b FROM videos",
+    "SELECT 'a; DROP TABLE videos' FROM public.videos",
+    "WITH t(c) AS MATERIALIZED (SELECT creator_id FROM videos) SELECT COUNT(*) FROM t, videos v",
+    "SELECT COUNT(DISTINCT v.id) FROM videos v JOIN video_snapshots s ON s.video_id = v.id, daily_video_stats d",
+    "SELECT COUNT(*) FROM (SELECT 1) s, videos v",
+    "SELECT * FROM generate_series(1, 3) g, LATERAL (SELECT 1) x, videos",
+    "SELECT 1 FROM videos WHERE creator_id IN (1, 2) ORDER BY 1, 2",
+]
+
+# Запросы, которые проверка должна отклонять
+REJECTED = [
+    "DELETE FROM videos",
+    "SELECT 1; DROP TABLE videos",
+    "SELECT * INTO t FROM videos",
+    "SELECT * FROM pg_catalog.pg_tables",
+    "SELECT pg_sleep(10)",
+    "SELECT * FROM videos FOR UPDATE",
+    "SELECT * FROM videos v, ingest_watermarks w",
+    # Таблица из списка FROM после подзапроса, табличной функции и JOIN ... ON
+    "SELECT COUNT(*) FROM (SELECT 1) s, ingest_watermarks",
+    "SELECT 1 FROM generate_series(1,2) g, ingest_checkpoints",
+    "SELECT 1 FROM videos v JOIN (SELECT 1 AS x) q ON true, ingest_checkpoints c",
+]
+
+
+def check_sql_validator() -> bool:
+    """Каждый запрос проверяется новым валидатором, без кэша решений"""
+    validator = SQLValidator(ALLOWED_TABLES, cache_size=0)
+    ok = True
+    
+    for sql in ACCEPTED:
+        try:
+            validator.validate(sql)
+            print(f"✅ принят: {sql}")
+        except SQLValidationError as e:
+            print(f"❌ отклонен: {sql}\n   {e}")
+            ok = False
+    
+    for sql in REJECTED:
+        try:
+            validator.validate(sql)
+            print(f"❌ принят: {sql}")
+            ok = False
+        except SQLValidationError as e:
+            print(f"✅ отклонен: {sql}\n   {e}")
+    
+    return ok
+
+
+if __name__ == "__main__":
+    if not check_sql_validator():
+        print("❌ Проверка SQL пропускает или отклоняет не те запросы")
+        sys.exit(1)
+    print("✅ Проверка SQL работает как ожидается")
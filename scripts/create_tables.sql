@@ -1,37 +1,146 @@
--- Таблица videos 
-CREATE TABLE IF NOT EXISTS videos (
-    id BIGINT PRIMARY KEY,
-    creator_id BIGINT NOT NULL,
-    video_created_at TIMESTAMP WITH TIME ZONE NOT NULL,
-    views_count BIGINT DEFAULT 0,
-    likes_count BIGINT DEFAULT 0,
-    comments_count BIGINT DEFAULT 0,
-    reports_count BIGINT DEFAULT 0,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
-
--- Таблица video_snapshots 
-CREATE TABLE IF NOT EXISTS video_snapshots (
-    id BIGSERIAL PRIMARY KEY,
-    video_id BIGINT NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
-    views_count BIGINT DEFAULT 0,
-    likes_count BIGINT DEFAULT 0,
-    comments_count BIGINT DEFAULT 0,
-    reports_count BIGINT DEFAULT 0,
-    delta_views_count BIGINT DEFAULT 0,
-    delta_likes_count BIGINT DEFAULT 0,
-    delta_comments_count BIGINT DEFAULT 0,
-    delta_reports_count BIGINT DEFAULT 0,
-    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
-    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    CONSTRAINT fk_video FOREIGN KEY(video_id) REFERENCES videos(id)
-);
-
--- Индексы для оптимизации запросов
-CREATE INDEX IF NOT EXISTS idx_videos_creator_id ON videos(creator_id);
-CREATE INDEX IF NOT EXISTS idx_videos_created_at ON videos(video_created_at);
-CREATE INDEX IF NOT EXISTS idx_videos_views ON videos(views_count);
-CREATE INDEX IF NOT EXISTS idx_snapshots_video_id ON video_snapshots(video_id);
-CREATE INDEX IF NOT EXISTS idx_snapshots_created_at ON video_snapshots(created_at);
-CREATE INDEX IF NOT EXISTS idx_snapshots_delta_views ON video_snapshots(delta_views_count);
\ No newline at end of file
+-- Таблица videos 
+CREATE TABLE IF NOT EXISTS videos (
+    id BIGINT PRIMARY KEY,
+    creator_id BIGINT NOT NULL,
+    video_created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    views_count BIGINT DEFAULT 0,
+    likes_count BIGINT DEFAULT 0,
+    comments_count BIGINT DEFAULT 0,
+    reports_count BIGINT DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Таблица video_snapshots 
+CREATE TABLE IF NOT EXISTS video_snapshots (
+    id BIGSERIAL PRIMARY KEY,
+    video_id BIGINT NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    views_count BIGINT DEFAULT 0,
+    likes_count BIGINT DEFAULT 0,
+    comments_count BIGINT DEFAULT 0,
+    reports_count BIGINT DEFAULT 0,
+    delta_views_count BIGINT DEFAULT 0,
+    delta_likes_count BIGINT DEFAULT 0,
+    delta_comments_count BIGINT DEFAULT 0,
+    delta_reports_count BIGINT DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_video FOREIGN KEY(video_id) REFERENCES videos(id)
+);
+
+-- Версия данных: загрузчик увеличивает ее после каждой загрузки,
+-- по ней бот инвалидирует кэш результатов запросов
+CREATE TABLE IF NOT EXISTS data_version (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+-- Индексы для оптимизации запросов
+CREATE INDEX IF NOT EXISTS idx_videos_creator_id ON videos(creator_id);
+CREATE INDEX IF NOT EXISTS idx_videos_created_at ON videos(video_created_at);
+CREATE INDEX IF NOT EXISTS idx_videos_views ON videos(views_count);
+CREATE INDEX IF NOT EXISTS idx_snapshots_created_at ON video_snapshots(created_at);
+
+-- В секционированной схеме (scripts/partition_snapshots.sql) эти индексы не нужны:
+-- поиск по video_id покрывает уникальный индекс (video_id, created_at)
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'video_snapshots'::regclass) = 'r' THEN
+        CREATE INDEX IF NOT EXISTS idx_snapshots_video_id ON video_snapshots(video_id);
+        CREATE INDEX IF NOT EXISTS idx_snapshots_delta_views ON video_snapshots(delta_views_count);
+    END IF;
+END $$;
+
+-- Уникальность снапшота: повторная загрузка не создает дубликатов.
+-- Для существующей базы дубликаты удаляются перед созданием индекса.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'uq_snapshots_video_created_at') THEN
+        DELETE FROM video_snapshots a
+        USING video_snapshots b
+        WHERE a.video_id = b.video_id AND a.created_at = b.created_at AND a.id > b.id;
+        
+        CREATE UNIQUE INDEX uq_snapshots_video_created_at ON video_snapshots(video_id, created_at);
+    END IF;
+END $$;
+
+-- Watermark инкрементальной загрузки: последний загруженный снапшот каждого видео
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    video_id BIGINT PRIMARY KEY REFERENCES videos(id) ON DELETE CASCADE,
+    last_snapshot_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Чекпоинт загрузки файла: сколько видео уже записано, для продолжения после сбоя
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    source TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    videos_done BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дневные агрегаты: вопросы "за день" читают O(дней), а не O(снапшотов).
+-- Загрузчик обновляет их инкрементально вместе со вставкой снапшотов.
+CREATE TABLE IF NOT EXISTS daily_video_stats (
+    day DATE NOT NULL,
+    video_id BIGINT NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    creator_id BIGINT NOT NULL,
+    delta_views_count BIGINT NOT NULL DEFAULT 0,
+    delta_likes_count BIGINT NOT NULL DEFAULT 0,
+    delta_comments_count BIGINT NOT NULL DEFAULT 0,
+    delta_reports_count BIGINT NOT NULL DEFAULT 0,
+    new_views_snapshots INTEGER NOT NULL DEFAULT 0,
+    new_likes_snapshots INTEGER NOT NULL DEFAULT 0,
+    new_comments_snapshots INTEGER NOT NULL DEFAULT 0,
+    new_reports_snapshots INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, video_id)
+);
+
+CREATE TABLE IF NOT EXISTS daily_creator_stats (
+    day DATE NOT NULL,
+    creator_id BIGINT NOT NULL,
+    delta_views_count BIGINT NOT NULL DEFAULT 0,
+    delta_likes_count BIGINT NOT NULL DEFAULT 0,
+    delta_comments_count BIGINT NOT NULL DEFAULT 0,
+    delta_reports_count BIGINT NOT NULL DEFAULT 0,
+    videos_with_new_views INTEGER NOT NULL DEFAULT 0,
+    videos_with_new_likes INTEGER NOT NULL DEFAULT 0,
+    videos_with_new_comments INTEGER NOT NULL DEFAULT 0,
+    videos_with_new_reports INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, creator_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_video_stats_creator ON daily_video_stats(creator_id, day);
+
+-- Первичное заполнение агрегатов для базы, где снапшоты уже загружены
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM daily_video_stats) AND EXISTS (SELECT 1 FROM video_snapshots) THEN
+        INSERT INTO daily_video_stats
+        SELECT DATE(s.created_at), s.video_id, v.creator_id,
+               SUM(s.delta_views_count), SUM(s.delta_likes_count),
+               SUM(s.delta_comments_count), SUM(s.delta_reports_count),
+               COUNT(*) FILTER (WHERE s.delta_views_count > 0),
+               COUNT(*) FILTER (WHERE s.delta_likes_count > 0),
+               COUNT(*) FILTER (WHERE s.delta_comments_count > 0),
+               COUNT(*) FILTER (WHERE s.delta_reports_count > 0)
+        FROM video_snapshots s
+        JOIN videos v ON v.id = s.video_id
+        GROUP BY DATE(s.created_at), s.video_id, v.creator_id;
+        
+        INSERT INTO daily_creator_stats
+        SELECT day, creator_id,
+               SUM(delta_views_count), SUM(delta_likes_count),
+               SUM(delta_comments_count), SUM(delta_reports_count),
+               COUNT(*) FILTER (WHERE new_views_snapshots > 0),
+               COUNT(*) FILTER (WHERE new_likes_snapshots > 0),
+               COUNT(*) FILTER (WHERE new_comments_snapshots > 0),
+               COUNT(*) FILTER (WHERE new_reports_snapshots > 0)
+        FROM daily_video_stats
+        GROUP BY day, creator_id
+        ON CONFLICT (day, creator_id) DO NOTHING;
+    END IF;
+END $$;
\ No newline at end of file
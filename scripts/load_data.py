@@ -1,91 +1,430 @@
-import json
-import asyncio
-import asyncpg
-from datetime import datetime
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-async def load_json_to_db(json_file_path: str):
-    """Загрузка данных из JSON в PostgreSQL"""
-    
-    
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    
-    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
-    
-    print(f"📊 Загружено {len(data)} видео...")
-    
-    try:
-        videos_inserted = 0
-        snapshots_inserted = 0
-        
-        for video in data:
-            
-            await conn.execute("""
-                INSERT INTO videos (id, creator_id, video_created_at, views_count, 
-                                  likes_count, comments_count, reports_count, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ON CONFLICT (id) DO NOTHING
-            """,
-            video['id'],
-            video['creator_id'],
-            video['video_created_at'],
-            video['views_count'],
-            video['likes_count'],
-            video['comments_count'],
-            video['reports_count'],
-            video['created_at'],
-            video['updated_at'])
-            
-            videos_inserted += 1
-            
-            
-            for snapshot in video.get('snapshots', []):
-                await conn.execute("""
-                    INSERT INTO video_snapshots 
-                    (video_id, views_count, likes_count, comments_count, reports_count,
-                     delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count,
-                     created_at, updated_at)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                """,
-                video['id'],
-                snapshot['views_count'],
-                snapshot['likes_count'],
-                snapshot['comments_count'],
-                snapshot['reports_count'],
-                snapshot.get('delta_views_count', 0),
-                snapshot.get('delta_likes_count', 0),
-                snapshot.get('delta_comments_count', 0),
-                snapshot.get('delta_reports_count', 0),
-                snapshot['created_at'],
-                snapshot.get('updated_at', snapshot['created_at']))
-                
-                snapshots_inserted += 1
-            
-            # Прогресс
-            if videos_inserted % 100 == 0:
-                print(f"⏳ Обработано {videos_inserted} видео, {snapshots_inserted} снапшотов...")
-        
-        print(f"\n🎉 Загрузка завершена!")
-        print(f"📽️ Видео: {videos_inserted}")
-        print(f"📸 Снапшотов: {snapshots_inserted}")
-        
-    except Exception as e:
-        print(f"❌ Ошибка: {str(e)}")
-        raise
-    finally:
-        await conn.close()
-
-
-if __name__ == "__main__":
-    json_file = "data/videos.json"
-    if not os.path.exists(json_file):
-        print(f"❌ Файл {json_file} не найден!")
-        print("Убедитесь, что файл videos.json находится в папке data/")
-    else:
-        asyncio.run(load_json_to_db(json_file))
\ No newline at end of file
+import argparse
+import json
+import asyncio
+import asyncpg
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import os
+from dateutil.parser import isoparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Сколько строк снапшотов копируется в одной транзакции
+BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", "50000"))
+
+# Размер куска файла при потоковом чтении JSON
+READ_CHUNK_SIZE = 1 << 20
+
+VIDEO_COLUMNS = [
+    'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+    'comments_count', 'reports_count', 'created_at', 'updated_at'
+]
+
+SNAPSHOT_COLUMNS = [
+    'video_id', 'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'created_at', 'updated_at'
+]
+
+METRICS = ['views', 'likes', 'comments', 'reports']
+
+# Колонки дневных агрегатов (daily_video_stats / daily_creator_stats)
+DELTA_COLUMNS = [f'delta_{metric}_count' for metric in METRICS]
+NEW_SNAPSHOT_COLUMNS = [f'new_{metric}_snapshots' for metric in METRICS]
+CREATOR_VIDEO_COLUMNS = [f'videos_with_new_{metric}' for metric in METRICS]
+
+
+async def bump_data_version(conn) -> int:
+    """Новая версия данных: кэш результатов в боте сбрасывается по NOTIFY"""
+    version = await conn.fetchval("""
+        INSERT INTO data_version (id, version) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE
+        SET version = data_version.version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    """)
+    await conn.execute("SELECT pg_notify('data_version', $1)", str(version))
+    return version
+
+
+def iter_videos(json_file_path: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Потоковое чтение видео по одному: в памяти только текущий объект и кусок файла
+    
+    Поддерживается исходный формат (JSON-массив видео) и NDJSON (.ndjson/.jsonl).
+    """
+    if json_file_path.endswith(('.ndjson', '.jsonl')):
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        return
+    
+    decoder = json.JSONDecoder()
+    with open(json_file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        pos = 0
+        eof = not buffer
+        
+        def skip(pos: int, chars: str) -> int:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            return pos
+        
+        pos = skip(pos, ' \t\r\n\ufeff')
+        if pos >= len(buffer) or buffer[pos] != '[':
+            raise ValueError(f"{json_file_path}: ожидается JSON-массив видео")
+        pos += 1
+        
+        while True:
+            pos = skip(pos, ' \t\r\n,')
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError("Unexpected end of buffer", buffer, pos)
+                video, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Объект не поместился в буфер: дочитываем следующий кусок
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            
+            yield video
+            
+            if pos >= chunk_size:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def parse_timestamp(value: Any) -> datetime:
+    """Время с зоной: watermark из timestamptz приходит с зоной, и наивное время с ним не сравнить
+    
+    Время без смещения считается UTC - так его и раньше записывал asyncpg.
+    """
+    if not isinstance(value, datetime):
+        value = isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def video_record(video: Dict[str, Any]) -> Tuple:
+    return (
+        video['id'],
+        video['creator_id'],
+        parse_timestamp(video['video_created_at']),
+        video['views_count'],
+        video['likes_count'],
+        video['comments_count'],
+        video['reports_count'],
+        parse_timestamp(video['created_at']),
+        parse_timestamp(video['updated_at'])
+    )
+
+
+def snapshot_records(video: Dict[str, Any]) -> List[Tuple]:
+    records = []
+    for snapshot in video.get('snapshots', []):
+        created_at = parse_timestamp(snapshot['created_at'])
+        records.append((
+            video['id'],
+            snapshot['views_count'],
+            snapshot['likes_count'],
+            snapshot['comments_count'],
+            snapshot['reports_count'],
+            snapshot.get('delta_views_count', 0),
+            snapshot.get('delta_likes_count', 0),
+            snapshot.get('delta_comments_count', 0),
+            snapshot.get('delta_reports_count', 0),
+            created_at,
+            parse_timestamp(snapshot['updated_at']) if snapshot.get('updated_at') else created_at
+        ))
+    return records
+
+
+async def create_staging_tables(conn):
+    """Временные таблицы для COPY: ON CONFLICT у COPY нет, поэтому вставка идет через них"""
+    await conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS videos_staging
+        (LIKE videos INCLUDING DEFAULTS)
+        ON COMMIT DELETE ROWS
+    """)
+    # Без id: иначе staging расходовал бы значения последовательности video_snapshots
+    await conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS snapshots_staging
+        ON COMMIT DELETE ROWS
+        AS SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM video_snapshots WITH NO DATA
+    """)
+
+
+def inserted_rows(status: str) -> int:
+    """Число строк из статуса команды вида 'INSERT 0 42'"""
+    return int(status.split()[-1])
+
+
+async def load_watermarks(conn) -> Dict[int, datetime]:
+    """Последний загруженный снапшот по каждому видео"""
+    rows = await conn.fetch("SELECT video_id, last_snapshot_at FROM ingest_watermarks")
+    return {row['video_id']: row['last_snapshot_at'] for row in rows}
+
+
+def file_fingerprint(json_file_path: str) -> str:
+    stat = os.stat(json_file_path)
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+async def load_checkpoint(conn, json_file_path: str) -> int:
+    """Сколько видео из этого файла уже записано прошлым (прерванным) запуском"""
+    row = await conn.fetchrow(
+        "SELECT fingerprint, videos_done FROM ingest_checkpoints WHERE source = $1",
+        json_file_path
+    )
+    if row is None or row['fingerprint'] != file_fingerprint(json_file_path):
+        return 0
+    return row['videos_done']
+
+
+async def has_snapshot_partitions(conn) -> bool:
+    """video_snapshots секционирована (scripts/partition_snapshots.sql)"""
+    return await conn.fetchval(
+        "SELECT to_regproc('ensure_snapshot_partitions') IS NOT NULL"
+    )
+
+
+async def write_batch(conn, videos: List[Tuple], snapshots: List[Tuple],
+                      incremental: bool = False, checkpoint: Optional[Tuple[str, str, int]] = None,
+                      partitioned: bool = False) -> Tuple[int, int, Optional[int]]:
+    """Запись пачки одной транзакцией через COPY
+    
+    Возвращает число реально вставленных строк и новую версию данных (None - пачка ничего не изменила).
+    Версия поднимается в той же транзакции: NOTIFY уходит при коммите вместе со строками, и прерванная
+    загрузка не оставляет в базе данных, о которых не знает кэш бота.
+    """
+    videos_written = 0
+    snapshots_written = 0
+    version = None
+    async with conn.transaction():
+        if partitioned and snapshots:
+            # Секции под даты пачки; запас в день на разницу часовых поясов
+            first = min(record[9] for record in snapshots)
+            last = max(record[9] for record in snapshots)
+            await conn.execute(
+                "SELECT ensure_snapshot_partitions($1, GREATEST($2, CURRENT_DATE + 92))",
+                first.date() - timedelta(days=1), last.date() + timedelta(days=1)
+            )
+        if videos:
+            await conn.copy_records_to_table('videos_staging', records=videos, columns=VIDEO_COLUMNS)
+            if incremental:
+                # Итоговые счетчики видео растут, поэтому при дозагрузке они обновляются
+                on_conflict = f"""
+                    ON CONFLICT (id) DO UPDATE SET
+                    {', '.join(f'{column} = EXCLUDED.{column}' for column in VIDEO_COLUMNS[3:])}
+                    WHERE EXCLUDED.updated_at > videos.updated_at
+                """
+            else:
+                on_conflict = "ON CONFLICT (id) DO NOTHING"
+            status = await conn.execute(f"""
+                INSERT INTO videos ({', '.join(VIDEO_COLUMNS)})
+                SELECT {', '.join(VIDEO_COLUMNS)} FROM videos_staging
+                {on_conflict}
+            """)
+            videos_written = inserted_rows(status)
+        if snapshots:
+            await conn.copy_records_to_table('snapshots_staging', records=snapshots, columns=SNAPSHOT_COLUMNS)
+            # Дневные агрегаты пополняются только реально вставленными снапшотами
+            snapshots_written = await conn.fetchval(f"""
+                WITH inserted AS (
+                    INSERT INTO video_snapshots ({', '.join(SNAPSHOT_COLUMNS)})
+                    SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM snapshots_staging
+                    -- Порядок по времени держит BRIN-индекс по created_at компактным
+                    ORDER BY created_at
+                    ON CONFLICT (video_id, created_at) DO NOTHING
+                    RETURNING video_id, created_at, {', '.join(DELTA_COLUMNS)}
+                ), daily AS (
+                    INSERT INTO daily_video_stats AS d
+                    (day, video_id, creator_id, {', '.join(DELTA_COLUMNS)}, {', '.join(NEW_SNAPSHOT_COLUMNS)})
+                    SELECT DATE(i.created_at), i.video_id, v.creator_id,
+                           {', '.join(f'SUM(i.{column})' for column in DELTA_COLUMNS)},
+                           {', '.join(f'COUNT(*) FILTER (WHERE i.{column} > 0)' for column in DELTA_COLUMNS)}
+                    FROM inserted i
+                    JOIN videos v ON v.id = i.video_id
+                    GROUP BY DATE(i.created_at), i.video_id, v.creator_id
+                    ON CONFLICT (day, video_id) DO UPDATE SET
+                    {', '.join(f'{column} = d.{column} + EXCLUDED.{column}' for column in DELTA_COLUMNS + NEW_SNAPSHOT_COLUMNS)}
+                )
+                SELECT COUNT(*) FROM inserted
+            """)
+            # Агрегаты по креаторам пересчитываются из дневных агрегатов видео для затронутых дней
+            await conn.execute(f"""
+                INSERT INTO daily_creator_stats AS c
+                (day, creator_id, {', '.join(DELTA_COLUMNS)}, {', '.join(CREATOR_VIDEO_COLUMNS)})
+                SELECT d.day, d.creator_id,
+                       {', '.join(f'SUM(d.{column})' for column in DELTA_COLUMNS)},
+                       {', '.join(f'COUNT(*) FILTER (WHERE d.{column} > 0)' for column in NEW_SNAPSHOT_COLUMNS)}
+                FROM daily_video_stats d
+                WHERE (d.day, d.creator_id) IN (
+                    SELECT DISTINCT DATE(s.created_at), v.creator_id
+                    FROM snapshots_staging s
+                    JOIN videos v ON v.id = s.video_id
+                )
+                GROUP BY d.day, d.creator_id
+                ON CONFLICT (day, creator_id) DO UPDATE SET
+                {', '.join(f'{column} = EXCLUDED.{column}' for column in DELTA_COLUMNS + CREATOR_VIDEO_COLUMNS)}
+            """)
+            await conn.execute("""
+                INSERT INTO ingest_watermarks (video_id, last_snapshot_at)
+                SELECT video_id, MAX(created_at) FROM snapshots_staging GROUP BY video_id
+                ON CONFLICT (video_id) DO UPDATE
+                SET last_snapshot_at = GREATEST(ingest_watermarks.last_snapshot_at, EXCLUDED.last_snapshot_at),
+                    updated_at = CURRENT_TIMESTAMP
+            """)
+        if checkpoint:
+            await conn.execute("""
+                INSERT INTO ingest_checkpoints (source, fingerprint, videos_done)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (source) DO UPDATE
+                SET fingerprint = EXCLUDED.fingerprint, videos_done = EXCLUDED.videos_done,
+                    updated_at = CURRENT_TIMESTAMP
+            """, *checkpoint)
+        if videos_written or snapshots_written:
+            version = await bump_data_version(conn)
+    return videos_written, snapshots_written, version
+
+
+async def load_json_to_db(json_file_path: str, batch_size: int = BATCH_SIZE,
+                          incremental: bool = False, resume: bool = True):
+    """Загрузка данных из JSON в PostgreSQL
+    
+    incremental: пропускать снапшоты не новее watermark видео и обновлять счетчики видео.
+    resume: продолжить с чекпоинта, если прошлый запуск по этому файлу прервался.
+    Возвращает счетчики загрузки (их использует benchmarks/bench_loader.py).
+    """
+    
+    
+    conn = await asyncpg.connect(os.getenv("DATABASE_URL"))
+    
+    print(f"📊 Потоковая загрузка {json_file_path}...")
+    
+    try:
+        await create_staging_tables(conn)
+        
+        partitioned = await has_snapshot_partitions(conn)
+        watermarks = await load_watermarks(conn) if incremental else {}
+        fingerprint = file_fingerprint(json_file_path)
+        skip_videos = await load_checkpoint(conn, json_file_path) if resume else 0
+        if skip_videos:
+            print(f"↩️ Продолжаем с чекпоинта: пропускаем {skip_videos} уже записанных видео")
+        
+        videos_seen = 0
+        videos_inserted = 0
+        snapshots_inserted = 0
+        snapshots_skipped = 0
+        rows_sent = 0
+        started = time.monotonic()
+        
+        version = None
+        
+        video_batch: List[Tuple] = []
+        snapshot_batch: List[Tuple] = []
+        
+        async def flush():
+            nonlocal videos_inserted, snapshots_inserted, rows_sent, version
+            written = await write_batch(
+                conn, video_batch, snapshot_batch, incremental,
+                checkpoint=(json_file_path, fingerprint, videos_seen),
+                partitioned=partitioned
+            )
+            videos_inserted += written[0]
+            snapshots_inserted += written[1]
+            if written[2] is not None:
+                version = written[2]
+            rows_sent += len(video_batch) + len(snapshot_batch)
+            video_batch.clear()
+            snapshot_batch.clear()
+        
+        for video in iter_videos(json_file_path):
+            videos_seen += 1
+            if videos_seen <= skip_videos:
+                continue
+            
+            video_batch.append(video_record(video))
+            records = snapshot_records(video)
+            watermark = watermarks.get(video['id'])
+            if watermark is not None:
+                new_records = [record for record in records if record[9] > watermark]
+                snapshots_skipped += len(records) - len(new_records)
+                records = new_records
+            snapshot_batch.extend(records)
+            
+            if len(snapshot_batch) >= batch_size or len(video_batch) >= batch_size:
+                await flush()
+                
+                # Прогресс
+                elapsed = time.monotonic() - started
+                rate = rows_sent / elapsed if elapsed else 0
+                print(f"⏳ Обработано {videos_seen} видео, {snapshots_inserted} новых снапшотов ({rate:,.0f} строк/с)...")
+        
+        if video_batch or snapshot_batch:
+            await flush()
+        
+        # Файл загружен целиком: чекпоинт больше не нужен
+        await conn.execute("DELETE FROM ingest_checkpoints WHERE source = $1", json_file_path)
+        
+        elapsed = time.monotonic() - started
+        rate = rows_sent / elapsed if elapsed else 0
+        
+        print(f"\n🎉 Загрузка завершена!")
+        print(f"📽️ Видео: {videos_seen} (записано {videos_inserted})")
+        print(f"📸 Снапшотов: {snapshots_inserted} новых, {snapshots_skipped} пропущено по watermark")
+        print(f"⚡ Скорость: {rate:,.0f} строк/с за {elapsed:.1f} с")
+        if version is not None:
+            print(f"🔖 Версия данных: {version}")
+        else:
+            print("🔖 Новых данных нет, версия данных не изменилась")
+        
+        return {
+            'videos_seen': videos_seen,
+            'videos_inserted': videos_inserted,
+            'snapshots_inserted': snapshots_inserted,
+            'snapshots_skipped': snapshots_skipped,
+            'rows_sent': rows_sent,
+            'elapsed': elapsed,
+            'data_version': version,
+        }
+        
+    except Exception as e:
+        print(f"❌ Ошибка: {str(e)}")
+        raise
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка видео и снапшотов из JSON в PostgreSQL")
+    parser.add_argument("json_file", nargs="?", default="data/videos.json")
+    parser.add_argument("--incremental", action="store_true",
+                        help="загружать только снапшоты новее watermark каждого видео")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-resume", action="store_true",
+                        help="не продолжать с чекпоинта прерванного запуска")
+    args = parser.parse_args()
+    
+    json_file = args.json_file
+    if not os.path.exists(json_file):
+        print(f"❌ Файл {json_file} не найден!")
+        print("Убедитесь, что файл videos.json находится в папке data/")
+    else:
+        asyncio.run(load_json_to_db(
+            json_file,
+            batch_size=args.batch_size,
+            incremental=args.incremental,
+            resume=not args.no_resume
+        ))
@@ -0,0 +1,85 @@
+-- Секционирование video_snapshots по месяцам created_at с BRIN-индексом по времени.
+-- Выполняется после create_tables.sql (python scripts/__init__db.py --partitioned):
+-- обычная таблица переносится в секционированную, для уже секционированной
+-- только создаются недостающие секции.
+
+-- Создание месячных секций, покрывающих [from_date, to_date]
+CREATE OR REPLACE FUNCTION ensure_snapshot_partitions(
+    from_date DATE,
+    to_date DATE DEFAULT CURRENT_DATE + 92
+) RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_date)::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= to_date LOOP
+        partition_name := format('video_snapshots_%s', to_char(month_start, 'YYYY_MM'));
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF video_snapshots FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END $$;
+
+-- Миграция с обычной таблицы
+DO $$
+DECLARE
+    first_day DATE;
+    last_day DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'video_snapshots'::regclass) <> 'r' THEN
+        RETURN;
+    END IF;
+    
+    ALTER TABLE video_snapshots RENAME TO video_snapshots_legacy;
+    ALTER TABLE video_snapshots_legacy RENAME CONSTRAINT video_snapshots_pkey TO video_snapshots_legacy_pkey;
+    -- Последовательность id переходит к новой таблице и не удаляется вместе со старой
+    ALTER SEQUENCE video_snapshots_id_seq OWNED BY NONE;
+    DROP INDEX IF EXISTS idx_snapshots_video_id, idx_snapshots_created_at,
+                         idx_snapshots_delta_views, uq_snapshots_video_created_at;
+    
+    CREATE TABLE video_snapshots (
+        id BIGINT NOT NULL DEFAULT nextval('video_snapshots_id_seq'),
+        video_id BIGINT NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+        views_count BIGINT DEFAULT 0,
+        likes_count BIGINT DEFAULT 0,
+        comments_count BIGINT DEFAULT 0,
+        reports_count BIGINT DEFAULT 0,
+        delta_views_count BIGINT DEFAULT 0,
+        delta_likes_count BIGINT DEFAULT 0,
+        delta_comments_count BIGINT DEFAULT 0,
+        delta_reports_count BIGINT DEFAULT 0,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    
+    ALTER SEQUENCE video_snapshots_id_seq OWNED BY video_snapshots.id;
+    
+    CREATE UNIQUE INDEX uq_snapshots_video_created_at ON video_snapshots(video_id, created_at);
+    -- Снапшоты пишутся примерно по возрастанию времени, BRIN на порядки меньше B-tree
+    CREATE INDEX idx_snapshots_created_at ON video_snapshots USING BRIN (created_at);
+    
+    SELECT MIN(created_at)::date - 1, MAX(created_at)::date + 1
+    INTO first_day, last_day
+    FROM video_snapshots_legacy;
+    PERFORM ensure_snapshot_partitions(
+        COALESCE(first_day, CURRENT_DATE),
+        GREATEST(COALESCE(last_day, CURRENT_DATE), CURRENT_DATE + 92)
+    );
+    
+    INSERT INTO video_snapshots
+    SELECT * FROM video_snapshots_legacy
+    ORDER BY created_at;
+    
+    DROP TABLE video_snapshots_legacy;
+END $$;
+
+-- Секции на ближайшие месяцы
+SELECT ensure_snapshot_partitions(CURRENT_DATE);
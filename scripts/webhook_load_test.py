@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import time
+
+from aiohttp import ClientSession, TCPConnector, web
+
+
+# Нагрузочный тест вебхука: скрипт поднимает заглушку Bot API и шлет боту фейковые апдейты.
+# Бот запускается отдельно с указанием на заглушку:
+#   BOT_MODE=webhook TELEGRAM_API_URL=http://localhost:8081 TELEGRAM_BOT_TOKEN=123:test python src/bot.py
+#   python scripts/webhook_load_test.py --updates 2000 --concurrency 100
+
+DEFAULT_QUESTION = "Сколько всего видео есть в системе?"
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отвечает ok на любой метод и считает отправленные ответы"""
+    
+    def __init__(self):
+        self.replies = 0
+        self.methods = {}
+        self.all_replied = asyncio.Event()
+        self.expected = 0
+    
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.methods[method] = self.methods.get(method, 0) + 1
+        form = await request.post()
+        
+        if method.lower() in ('sendmessage', 'editmessagetext'):
+            self.replies += 1
+            if self.replies >= self.expected:
+                self.all_replied.set()
+            chat_id = int(form.get('chat_id', 0))
+            result = {
+                'message_id': self.replies,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': form.get('text', ''),
+            }
+        elif method.lower() == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+def make_update(update_id: int, user_id: int, question: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': question,
+        },
+    }
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_load_test(webhook_url: str, api_port: int, updates: int, concurrency: int,
+                        users: int, question: str, secret: str, reply_timeout: float) -> dict:
+    fake_api = FakeBotAPI()
+    fake_api.expected = updates
+    app = web.Application()
+    app.router.add_route('POST', '/bot{token}/{method}', fake_api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', api_port).start()
+    
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    latencies = []
+    errors = 0
+    queue = iter(range(updates))
+    
+    async def sender(session: ClientSession):
+        nonlocal errors
+        for update_id in queue:
+            update = make_update(update_id, 1_000_000 + update_id % users, question)
+            started = time.perf_counter()
+            try:
+                async with session.post(webhook_url, json=update, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    try:
+        async with ClientSession(connector=TCPConnector(limit=concurrency)) as session:
+            await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+        accepted_in = time.perf_counter() - started
+        
+        try:
+            await asyncio.wait_for(fake_api.all_replied.wait(), reply_timeout)
+        except asyncio.TimeoutError:
+            pass
+        replied_in = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    
+    return {
+        'updates': updates,
+        'concurrency': concurrency,
+        'errors': errors,
+        'accepted_per_sec': round(updates / accepted_in, 1),
+        'replies': fake_api.replies,
+        'replies_per_sec': round(fake_api.replies / replied_in, 1),
+        'post_latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'post_latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'post_latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'api_methods': fake_api.methods,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест вебхука бота фейковыми апдейтами")
+    parser.add_argument("--webhook-url", default="http://localhost:8080/webhook")
+    parser.add_argument("--api-port", type=int, default=8081, help="порт заглушки Bot API (TELEGRAM_API_URL бота)")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000, help="сколько разных пользователей имитировать")
+    parser.add_argument("--question", default=DEFAULT_QUESTION)
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    parser.add_argument("--reply-timeout", type=float, default=60, help="сколько ждать ответов бота после отправки")
+    args = parser.parse_args()
+    
+    result = asyncio.run(run_load_test(
+        args.webhook_url, args.api_port, args.updates, args.concurrency,
+        args.users, args.question, args.secret, args.reply_timeout
+    ))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
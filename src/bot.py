@@ -1,153 +1,518 @@
-import asyncio
-import logging
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.types import Message
-from aiogram.enums import ParseMode
-
-from config import settings
-from database import Database
-from llm_sql_generator import LLMSQLGenerator
-
-
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-dp = Dispatcher()
-db = Database(settings.DATABASE_URL)
-llm_sql = LLMSQLGenerator(provider=settings.LLM_PROVIDER)
-
-
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
-    """Обработчик команды /start"""
-    welcome_text = """
-    🎬 *Бот аналитики видео-креаторов*
-    
-    Я умею отвечать на вопросы о статистике видео на естественном языке.
-    
-    *Примеры запросов:*
-    • Сколько всего видео есть в системе?
-    • Сколько видео у креатора с id 123 вышло с 1 по 5 ноября 2025?
-    • Сколько видео набрало больше 100000 просмотров?
-    • На сколько просмотров выросли все видео 28 ноября 2025?
-    • Сколько разных видео получали новые просмотры 27 ноября 2025?
-    
-    Просто напишите вопрос, и я верну число-ответ!
-    """
-    await message.answer(welcome_text, parse_mode=ParseMode.MARKDOWN)
-
-
-@dp.message(Command("help"))
-async def cmd_help(message: Message):
-    """Обработчик команды /help"""
-    help_text = """
-    *Как пользоваться ботом:*
-    
-    1. Задавайте вопросы на русском языке
-    2. Используйте естественные формулировки
-    3. Указывайте даты в формате "28 ноября 2025" или "с 1 по 5 ноября 2025"
-    4. Бот вернет одно число - ответ на ваш вопрос
-    
-    *Поддерживаемые типы запросов:*
-    • Подсчет видео (COUNT)
-    • Суммирование метрик (SUM)
-    • Подсчет уникальных значений (COUNT DISTINCT)
-    • Фильтрация по датам, креаторам, пороговым значениям
-    
-    *Пример:* "Сколько видео набрало больше 50000 лайков?"
-    """
-    await message.answer(help_text, parse_mode=ParseMode.MARKDOWN)
-
-
-@dp.message()
-async def handle_text_query(message: Message):
-    """Обработчик текстовых запросов"""
-    user_query = message.text.strip()
-    user_id = message.from_user.id
-    
-    logger.info(f"Query from user {user_id}: {user_query}")
-    
-    
-    await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-    
-    try:
-        
-        sql_query = llm_sql.generate_sql(user_query)
-        logger.info(f"Generated SQL: {sql_query}")
-        
-        
-        result = await db.execute_query(sql_query)
-        
-        
-        if result is None:
-            response = "0"
-        else:
-            
-            if isinstance(result, (list, tuple)) and len(result) > 0:
-                if isinstance(result[0], (list, tuple)) and len(result[0]) > 0:
-                    response = str(result[0][0])
-                else:
-                    response = str(result[0])
-            else:
-                response = str(result)
-        
-        
-        try:
-            num = int(float(response))
-            response = f"{num:,}".replace(",", " ")
-        except:
-            pass
-        
-        
-        await message.answer(f"📊 *Ответ:* {response}", parse_mode=ParseMode.MARKDOWN)
-        
-        
-        logger.info(f"Success response to user {user_id}: {response}")
-        
-    except Exception as e:
-        logger.error(f"Error processing query from user {user_id}: {str(e)}")
-        
-        
-        error_msg = (
-            "❌ *Произошла ошибка при обработке запроса*\n\n"
-            "Попробуйте:\n"
-            "1. Переформулировать вопрос более четко\n"
-            "2. Проверить корректность указанных данных\n"
-            "3. Использовать примеры из /help\n\n"
-            f"*Техническая информация:* `{str(e)[:100]}`"
-        )
-        await message.answer(error_msg, parse_mode=ParseMode.MARKDOWN)
-
-
-async def main():
-    """Основная функция запуска бота"""
-    logger.info("Starting video analytics bot...")
-    
-    
-    try:
-        settings.validate()
-        logger.info("Settings validation passed")
-    except ValueError as e:
-        logger.error(f"Settings validation failed: {e}")
-        print(f"❌ Ошибка конфигурации: {e}")
-        print("Проверьте файл .env")
-        return
-    
-    
-    try:
-        await db.connect()
-        logger.info("Database connection established")
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        print(f"❌ Ошибка подключения к БД: {e}")
-        return
-    
-    
-    await dp.start_polling(bot)
-
-
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+import time
+
+# Начало отсчета старта процесса: в замер попадают импорты ниже и прогрев в startup()
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import logging
+import multiprocessing
+import re
+import signal
+from typing import TYPE_CHECKING, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command
+from aiogram.types import Message
+from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from config import settings
+from database import Database
+from llm_sql_generator import LLMSQLGenerator
+from intent_parser import QueryPlan, build_templates, merge_plans
+from middlewares import InFlightTracker, QueryLimitMiddleware
+from metrics import registry, request_stages, start_metrics_server
+from log_setup import setup_logging
+
+if TYPE_CHECKING:
+    from columnar_engine import ColumnarEngine
+
+
+setup_logging(settings.LOG_LEVEL, settings.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+IMPORT_SECONDS = time.perf_counter() - STARTED_AT
+
+
+def create_bot() -> Bot:
+    if settings.TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
+        return Bot(token=settings.TELEGRAM_BOT_TOKEN, session=session)
+    return Bot(token=settings.TELEGRAM_BOT_TOKEN)
+
+
+# Объекты приложения создает create_app(): импорт модуля ничего не подключает и не строит
+bot: Optional[Bot] = None
+dp: Optional[Dispatcher] = None
+in_flight: Optional[InFlightTracker] = None
+db: Optional[Database] = None
+llm_sql: Optional[LLMSQLGenerator] = None
+engine: Optional["ColumnarEngine"] = None
+# Номер воркера вебхука: у каждого свой порт /metrics
+worker_index = 0
+metrics_runner: Optional[web.AppRunner] = None
+
+
+async def run_plan(plan: QueryPlan):
+    """Выполнение плана: сначала колоночный движок в памяти, затем Postgres"""
+    if engine is not None:
+        result = engine.evaluate(plan.intent, await db.get_data_version())
+        if result is not None:
+            return result
+    
+    # Боту нужно одно число: с сервера забирается только первое значение
+    if plan.template:
+        return await db.fetch_template_scalar(plan.template, *plan.params)
+    return await db.fetch_scalar(plan.sql, *plan.params)
+
+
+async def cmd_start(message: Message):
+    """Обработчик команды /start"""
+    welcome_text = """
+    🎬 *Бот аналитики видео-креаторов*
+    
+    Я умею отвечать на вопросы о статистике видео на естественном языке.
+    
+    *Примеры запросов:*
+    • Сколько всего видео есть в системе?
+    • Сколько видео у креатора с id 123 вышло с 1 по 5 ноября 2025?
+    • Сколько видео набрало больше 100000 просмотров?
+    • На сколько просмотров выросли все видео 28 ноября 2025?
+    • Сколько разных видео получали новые просмотры 27 ноября 2025?
+    
+    Просто напишите вопрос, и я верну число-ответ!
+    """
+    await message.answer(welcome_text, parse_mode=ParseMode.MARKDOWN)
+
+
+async def cmd_help(message: Message):
+    """Обработчик команды /help"""
+    help_text = """
+    *Как пользоваться ботом:*
+    
+    1. Задавайте вопросы на русском языке
+    2. Используйте естественные формулировки
+    3. Указывайте даты в формате "28 ноября 2025" или "с 1 по 5 ноября 2025"
+    4. Бот вернет одно число - ответ на ваш вопрос
+    5. Несколько вопросов можно прислать одним сообщением, по одному на строку
+    
+    *Поддерживаемые типы запросов:*
+    • Подсчет видео (COUNT)
+    • Суммирование метрик (SUM)
+    • Подсчет уникальных значений (COUNT DISTINCT)
+    • Фильтрация по датам, креаторам, пороговым значениям
+    
+    *Пример:* "Сколько видео набрало больше 50000 лайков?"
+    """
+    await message.answer(help_text, parse_mode=ParseMode.MARKDOWN)
+
+
+async def answer_query(user_query: str, fast_path: bool = True):
+    """Вопрос -> план -> число"""
+    plan = await llm_sql.aplan_query(user_query, fast_path=fast_path)
+    logger.info("Generated SQL: %s params=%s", plan.sql, plan.params)
+    return await run_plan(plan)
+
+
+def format_result(result) -> str:
+    response = "0" if result is None else str(result)
+    try:
+        num = int(float(response))
+        response = f"{num:,}".replace(",", " ")
+    except:
+        pass
+    return response
+
+
+# Не чаще одного редактирования ответа в секунду: Telegram ограничивает частоту правок
+BATCH_EDIT_INTERVAL = 1.0
+
+
+def render_batch(questions: List[str], answers: List[Optional[str]]) -> str:
+    lines = ["📊 *Ответы:*"]
+    for number, (question, answer) in enumerate(zip(questions, answers), 1):
+        question = re.sub(r'([_*`\[])', r'\\\1', question)
+        lines.append(f"{number}. {question} — {answer if answer is not None else '⏳'}")
+    return "\n".join(lines)
+
+
+async def answer_batch(questions: List[str]):
+    """Ответы на несколько вопросов по мере готовности: пары (номер вопроса, результат или исключение)
+    
+    Вопросы быстрого пути, на которые не ответил колоночный движок, идут одним SELECT
+    со скалярными подзапросами; остальные планируются через LLM и выполняются параллельно.
+    Общее время - как у самого долгого вопроса, а не сумма. Ошибка одного вопроса
+    (несуществующая дата, сбой БД) становится его результатом и не прерывает остальные.
+    """
+    fast_plans: Dict[int, QueryPlan] = {}
+    llm_questions: Dict[int, str] = {}
+    for index, question in enumerate(questions):
+        try:
+            plan = llm_sql.fast_plan(question)
+            if plan is None:
+                llm_questions[index] = question
+                continue
+            result = engine.evaluate(plan.intent, await db.get_data_version()) if engine is not None else None
+        except Exception as e:
+            yield index, e
+            continue
+        if result is not None:
+            yield index, result
+        else:
+            fast_plans[index] = plan
+    
+    async def run_merged(indexes: List[int]):
+        merged = merge_plans([fast_plans[index] for index in indexes])
+        logger.info("Merged SQL for %d questions: %s params=%s", len(indexes), merged.sql, merged.params)
+        rows = await db.execute_query(merged.sql, *merged.params)
+        return [(index, rows[0][column] if rows else None) for column, index in enumerate(indexes)]
+    
+    async def run_single(index: int, coroutine):
+        return [(index, await coroutine)]
+    
+    tasks: Dict[asyncio.Future, List[int]] = {}
+    if len(fast_plans) > 1:
+        tasks[asyncio.ensure_future(run_merged(list(fast_plans)))] = list(fast_plans)
+    else:
+        for index, plan in fast_plans.items():
+            tasks[asyncio.ensure_future(run_single(index, run_plan(plan)))] = [index]
+    for index, question in llm_questions.items():
+        tasks[asyncio.ensure_future(run_single(index, answer_query(question, fast_path=False)))] = [index]
+    
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    for index in tasks[task]:
+                        yield index, task.exception()
+                else:
+                    for index, result in task.result():
+                        yield index, result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def handle_batch(message: Message, questions: List[str]):
+    """Пакет вопросов: одно сообщение-ответ, которое дополняется по мере готовности ответов"""
+    user_id = message.from_user.id
+    if len(questions) > settings.BATCH_MAX_QUESTIONS:
+        await message.answer(f"❌ В одном сообщении можно задать не больше {settings.BATCH_MAX_QUESTIONS} вопросов")
+        return
+    
+    answers: List[Optional[str]] = [None] * len(questions)
+    text = render_batch(questions, answers)
+    with registry.span('send_message'):
+        reply = await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+    last_edit = time.monotonic()
+    
+    async def edit_reply():
+        nonlocal text, last_edit
+        new_text = render_batch(questions, answers)
+        if new_text == text:
+            return
+        try:
+            with registry.span('send_message'):
+                await reply.edit_text(new_text, parse_mode=ParseMode.MARKDOWN)
+            text = new_text
+        except Exception as e:
+            logger.warning("Failed to update batch reply for user %s: %s", user_id, e)
+        last_edit = time.monotonic()
+    
+    try:
+        async for index, result in answer_batch(questions):
+            if isinstance(result, Exception):
+                logger.error("Error processing batch question from user %s: %s: %s", user_id, questions[index], result)
+                answers[index] = "❌ ошибка"
+            else:
+                answers[index] = format_result(result)
+            if time.monotonic() - last_edit >= BATCH_EDIT_INTERVAL:
+                await edit_reply()
+    except Exception as e:
+        registry.inc('request_errors')
+        logger.error("Error processing batch from user %s: %s", user_id, e)
+    finally:
+        # ⏳ в ответе не остается: вопросы без результата помечаются ошибкой
+        for index, answer in enumerate(answers):
+            if answer is None:
+                answers[index] = "❌ ошибка"
+        await edit_reply()
+    
+    logger.info("Batch of %d answered for user %s", len(questions), user_id)
+
+
+async def handle_text_query(message: Message, coalesce=None):
+    """Обработчик текстовых запросов
+    
+    coalesce передает QueryLimitMiddleware: одинаковые вопросы в полете считаются один раз.
+    """
+    started = time.monotonic()
+    with request_stages() as stages:
+        await answer_message(message, coalesce)
+    elapsed = time.monotonic() - started
+    registry.observe('request_total', elapsed)
+    logger.info(
+        "Request from user %s done in %.3fs", message.from_user.id, elapsed,
+        extra={'user_id': message.from_user.id, 'duration': elapsed, 'stages': stages}
+    )
+
+
+async def answer_message(message: Message, coalesce=None):
+    user_query = message.text.strip()
+    user_id = message.from_user.id
+    
+    logger.info("Query from user %s: %s", user_id, user_query)
+    
+    
+    await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+    
+    # Несколько строк - несколько вопросов, отвечаем одним сообщением
+    questions = [line.strip() for line in user_query.splitlines() if line.strip()]
+    
+    try:
+    
+        if len(questions) > 1:
+            await handle_batch(message, questions)
+            return
+        
+        if coalesce is not None:
+            result = await coalesce(lambda: answer_query(user_query))
+        else:
+            result = await answer_query(user_query)
+        
+        
+        response = format_result(result)
+        
+        
+        with registry.span('send_message'):
+            await message.answer(f"📊 *Ответ:* {response}", parse_mode=ParseMode.MARKDOWN)
+        
+        
+        logger.info("Success response to user %s: %s", user_id, response)
+    
+    except Exception as e:
+        registry.inc('request_errors')
+        logger.error("Error processing query from user %s: %s", user_id, e)
+        
+        
+        error_msg = (
+            "❌ *Произошла ошибка при обработке запроса*\n\n"
+            "Попробуйте:\n"
+            "1. Переформулировать вопрос более четко\n"
+            "2. Проверить корректность указанных данных\n"
+            "3. Использовать примеры из /help\n\n"
+            f"*Техническая информация:* `{str(e)[:100]}`"
+        )
+        await message.answer(error_msg, parse_mode=ParseMode.MARKDOWN)
+
+
+def create_app() -> Dispatcher:
+    """Сборка бота: клиенты, БД, генератор SQL и диспетчер с обработчиками
+    
+    Вызывается в процессе, который будет принимать апдейты (у вебхука - в каждом воркере).
+    Подключения и прогрев - в startup().
+    """
+    global bot, dp, in_flight, db, llm_sql, engine
+    bot = create_bot()
+    db = Database(settings.DATABASE_URL)
+    db.register_templates(build_templates())
+    llm_sql = LLMSQLGenerator(provider=settings.LLM_PROVIDER)
+    engine = None
+    if settings.COLUMNAR_ENGINE_ENABLED:
+        # Движок и numpy импортируются только когда включены, как и SDK провайдеров LLM
+        from columnar_engine import ColumnarEngine
+        engine = ColumnarEngine(db, settings.COLUMNAR_REFRESH_INTERVAL)
+    registry.add_collector(db.gauges)
+    
+    dp = Dispatcher()
+    in_flight = InFlightTracker()
+    dp.update.outer_middleware(in_flight)
+    dp.message.middleware(QueryLimitMiddleware(
+        max_per_user=settings.BOT_MAX_CONCURRENT_PER_USER,
+        max_total=settings.BOT_MAX_CONCURRENT_TOTAL,
+        key_func=llm_sql.question_key
+    ))
+    dp.message.register(cmd_start, Command("start"))
+    dp.message.register(cmd_help, Command("help"))
+    dp.message.register(handle_text_query)
+    return dp
+
+
+async def preconnect_bot():
+    """getMe заранее: к первому ответу соединение с Bot API уже открыто"""
+    try:
+        await bot.me()
+    except Exception as e:
+        logger.warning("Bot API pre-connect failed: %s", e)
+
+
+async def startup():
+    """Подключения и прогрев до приема апдейтов (общая часть polling и webhook)
+    
+    Пул БД открывает min_size соединений с подготовленными шаблонами, клиенты LLM и бота
+    параллельно с ним подключаются к своим API, затем загружается колоночный движок.
+    """
+    await asyncio.gather(db.connect(), llm_sql.warm_up(), preconnect_bot())
+    logger.info("Database connection established")
+    
+    global metrics_runner
+    if settings.METRICS_PORT:
+        port = settings.METRICS_PORT + worker_index
+        metrics_runner = await start_metrics_server(settings.METRICS_HOST, port)
+        logger.info("Metrics available at http://%s:%d/metrics", settings.METRICS_HOST, port)
+    
+    global engine
+    if engine is not None:
+        if not engine.available():
+            logger.warning("COLUMNAR_ENGINE_ENABLED is set but numpy is not installed, using Postgres only")
+            engine = None
+        else:
+            try:
+                await engine.start()
+            except Exception as e:
+                logger.warning("Columnar engine load failed, using Postgres only: %s", e)
+                engine = None
+    
+    ready = time.perf_counter() - STARTED_AT
+    registry.observe('startup', IMPORT_SECONDS, phase='import')
+    registry.observe('startup', ready, phase='ready')
+    logger.info(
+        "Bot ready in %.3fs (imports %.3fs)", ready, IMPORT_SECONDS,
+        extra={'import_seconds': IMPORT_SECONDS, 'ready_seconds': ready}
+    )
+
+
+async def shutdown():
+    """Мягкая остановка: дожидаемся начатых обработчиков, затем закрываем пулы"""
+    await in_flight.drain(settings.SHUTDOWN_TIMEOUT)
+    if engine is not None:
+        await engine.stop()
+    await llm_sql.aclose()
+    await db.close()
+    await bot.session.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+def create_webhook_app() -> web.Application:
+    """aiohttp-приложение, принимающее апдейты Telegram на WEBHOOK_PATH"""
+    create_app()
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=settings.WEBHOOK_SECRET or None
+    ).register(app, path=settings.WEBHOOK_PATH)
+    
+    async def on_startup(app: web.Application):
+        await startup()
+    
+    async def on_shutdown(app: web.Application):
+        await shutdown()
+    
+    app.on_startup.append(on_startup)
+    # on_shutdown вызывается после остановки приема соединений: новые апдейты уже не приходят.
+    # Ставим свой обработчик первым - SimpleRequestHandler в своем закрывает сессию бота
+    app.on_shutdown.insert(0, on_shutdown)
+    return app
+
+
+async def register_webhook():
+    """Регистрация вебхука в Telegram; делается один раз в родительском процессе"""
+    if not settings.WEBHOOK_URL:
+        logger.info("WEBHOOK_URL is not set, skipping setWebhook")
+        return
+    
+    webhook_bot = create_bot()
+    try:
+        await webhook_bot.set_webhook(
+            url=settings.WEBHOOK_URL.rstrip('/') + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET or None,
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info("Webhook registered: %s%s", settings.WEBHOOK_URL, settings.WEBHOOK_PATH)
+    finally:
+        await webhook_bot.session.close()
+
+
+def serve_webhook(reuse_port: bool = False, index: int = 0):
+    """Один рабочий процесс вебхука; SIGINT/SIGTERM запускают мягкую остановку aiohttp"""
+    global worker_index
+    worker_index = index
+    web.run_app(
+        create_webhook_app(),
+        host=settings.WEBHOOK_HOST,
+        port=settings.WEBHOOK_PORT,
+        reuse_port=reuse_port,
+        shutdown_timeout=settings.SHUTDOWN_TIMEOUT,
+        print=None
+    )
+
+
+def run_webhook():
+    """Вебхук в WEBHOOK_WORKERS процессах, слушающих один порт (SO_REUSEPORT)"""
+    asyncio.run(register_webhook())
+    
+    workers = max(1, settings.WEBHOOK_WORKERS)
+    if workers == 1:
+        serve_webhook()
+        return
+    
+    processes = [multiprocessing.Process(target=serve_webhook, args=(True, index)) for index in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info("Started %d webhook workers on port %s", workers, settings.WEBHOOK_PORT)
+    
+    def stop_workers(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    
+    # SIGTERM (docker stop) пересылаем воркерам; SIGINT из терминала они получают сами всей группой
+    signal.signal(signal.SIGTERM, stop_workers)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for process in processes:
+        process.join()
+
+
+def main():
+    """Основная функция запуска бота"""
+    logger.info("Starting video analytics bot in %s mode...", settings.BOT_MODE)
+    
+    
+    try:
+        settings.validate()
+        logger.info("Settings validation passed")
+    except ValueError as e:
+        logger.error("Settings validation failed: %s", e)
+        print(f"❌ Ошибка конфигурации: {e}")
+        print("Проверьте файл .env")
+        return
+    
+    
+    if settings.BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
+
+
+async def run_polling():
+    """Long polling в одном процессе"""
+    create_app()
+    try:
+        await startup()
+    except Exception as e:
+        logger.error("Database connection failed: %s", e)
+        print(f"❌ Ошибка подключения к БД: {e}")
+        return
+    
+    
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
+
+
+if __name__ == "__main__":
+    main()
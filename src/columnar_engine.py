@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # движок необязательный: без numpy все запросы идут в Postgres
+    np = None
+
+from database import Database
+from intent_parser import Intent
+
+logger = logging.getLogger(__name__)
+
+
+METRICS = ['views', 'likes', 'comments', 'reports']
+
+# Дни храним как datetime64[D]; из Postgres они приходят числом дней от эпохи
+VIDEOS_QUERY = f"""
+    SELECT id, creator_id, DATE(video_created_at) - DATE '1970-01-01' AS day,
+           {', '.join(f'{metric}_count' for metric in METRICS)}
+    FROM videos
+"""
+
+DAILY_COLUMNS = ['video_id', 'creator_id'] + [f'delta_{metric}_count' for metric in METRICS] + \
+    [f'new_{metric}_snapshots' for metric in METRICS]
+
+DAILY_QUERY = f"""
+    SELECT day - DATE '1970-01-01' AS day, {', '.join(DAILY_COLUMNS)}
+    FROM daily_video_stats
+"""
+
+FETCH_CHUNK_SIZE = 100000
+
+
+class ColumnarEngine:
+    """Колоночная копия videos и daily_video_stats в памяти для интентов быстрого пути
+    
+    Столбцы - массивы NumPy, отсортированные по дню: диапазон дат ищется
+    бинарным поиском, фильтры и агрегаты считаются векторно. Интенты, которые
+    движок не умеет считать, возвращают None и выполняются в Postgres.
+    """
+    
+    SUPPORTED_INTENTS = ('total_videos', 'creator_videos', 'videos_over_threshold', 'growth', 'videos_with_growth')
+    
+    def __init__(self, db: Database, refresh_interval: float = 60):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.videos: Dict[str, Any] = {}
+        self.daily: Dict[str, Any] = {}
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self._data_version: Optional[int] = None
+        self._last_snapshot_id = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+    
+    async def start(self):
+        """Первичная загрузка и фоновое обновление"""
+        await self.refresh()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+    
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+    
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning("Columnar engine refresh failed: %s", e)
+    
+    async def refresh(self):
+        """Обновление по версии данных: videos перечитывается целиком, дневные агрегаты - только затронутые дни"""
+        version = await self.db.get_data_version()
+        if self.loaded and version is not None and version == self._data_version:
+            return
+    
+        started = time.monotonic()
+        async with self.db.acquire(read_only=True) as connection:
+            videos = await self._fetch_columns(connection, VIDEOS_QUERY, ['id', 'creator_id', 'day'] +
+                                               [f'{metric}_count' for metric in METRICS])
+            last_snapshot_id = await connection.fetchval("SELECT COALESCE(MAX(id), 0) FROM video_snapshots")
+    
+            # Снапшоты перезалиты заново (id меньше запомненного) - инкремент невозможен
+            if not self.loaded or last_snapshot_id < self._last_snapshot_id:
+                daily = await self._fetch_columns(connection, DAILY_QUERY, ['day'] + DAILY_COLUMNS)
+            else:
+                # Агрегаты меняются только за дни, в которые пришли новые снапшоты
+                touched_days = await connection.fetchval("""
+                    SELECT array_agg(DISTINCT DATE(created_at))
+                    FROM video_snapshots WHERE id > $1
+                """, self._last_snapshot_id)
+                daily = self.daily
+                if touched_days:
+                    fresh = await self._fetch_columns(
+                        connection, DAILY_QUERY + " WHERE day = ANY($1::date[])",
+                        ['day'] + DAILY_COLUMNS, touched_days
+                    )
+                    touched = np.array([np.datetime64(day, 'D') for day in touched_days])
+                    keep = ~np.isin(daily['day'], touched)
+                    daily = {column: np.concatenate([daily[column][keep], fresh[column]]) for column in daily}
+    
+        self.videos = self._sorted_by_day(videos)
+        self.daily = self._sorted_by_day(daily)
+        self._last_snapshot_id = last_snapshot_id
+        self._data_version = version
+        self.loaded = True
+        logger.info(
+            "Columnar engine refreshed in %.2fs: %d videos, %d daily rows",
+            time.monotonic() - started, len(self.videos['id']), len(self.daily['day'])
+        )
+    
+    async def _fetch_columns(self, connection, sql: str, columns: List[str], *args: Any) -> Dict[str, Any]:
+        """Чтение запроса кусками в массивы по колонкам"""
+        chunks: Dict[str, List[Any]] = {column: [] for column in columns}
+        async with connection.transaction():
+            cursor = await connection.cursor(sql, *args)
+            while True:
+                rows = await cursor.fetch(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                for index, column in enumerate(columns):
+                    dtype = 'int32' if column.startswith('new_') else 'int64'
+                    chunks[column].append(np.fromiter((row[index] or 0 for row in rows), dtype=dtype, count=len(rows)))
+    
+        arrays = {}
+        for column, parts in chunks.items():
+            dtype = 'int32' if column.startswith('new_') else 'int64'
+            array = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+            arrays[column] = array.astype('datetime64[D]') if column == 'day' else array
+        return arrays
+    
+    @staticmethod
+    def _sorted_by_day(columns: Dict[str, Any]) -> Dict[str, Any]:
+        order = np.argsort(columns['day'], kind='stable')
+        return {column: values[order] for column, values in columns.items()}
+    
+    @staticmethod
+    def _day_slice(days, start_date: Optional[date], end_date: Optional[date]) -> slice:
+        if start_date is None:
+            return slice(0, len(days))
+        start = np.searchsorted(days, np.datetime64(start_date, 'D'), side='left')
+        end = np.searchsorted(days, np.datetime64(end_date, 'D'), side='right')
+        return slice(start, end)
+    
+    def evaluate(self, intent: Optional[Intent], data_version: Optional[int] = None) -> Optional[int]:
+        """Ответ на интент из памяти или None, если его нужно выполнять в Postgres
+        
+        Если передана версия данных и копия от нее отстала, ответ тоже None:
+        устаревшие числа не отдаются, пока фоновое обновление не догонит базу.
+        """
+        if not self.loaded or intent is None or intent.name not in self.SUPPORTED_INTENTS:
+            self.misses += 1
+            return None
+        if data_version is not None and data_version != self._data_version:
+            self.misses += 1
+            return None
+    
+        if intent.name in ('total_videos', 'creator_videos', 'videos_over_threshold'):
+            rows = self._day_slice(self.videos['day'], intent.start_date, intent.end_date)
+            mask = np.ones(rows.stop - rows.start, dtype=bool)
+            if intent.creator_id is not None:
+                mask &= self.videos['creator_id'][rows] == intent.creator_id
+            if intent.threshold is not None:
+                mask &= self.videos[f'{intent.metric}_count'][rows] > intent.threshold
+            value = int(np.count_nonzero(mask))
+    
+        else:
+            rows = self._day_slice(self.daily['day'], intent.start_date, intent.end_date)
+            mask = np.ones(rows.stop - rows.start, dtype=bool)
+            if intent.creator_id is not None:
+                mask &= self.daily['creator_id'][rows] == intent.creator_id
+            if intent.name == 'growth':
+                value = int(self.daily[f'delta_{intent.metric}_count'][rows][mask].sum())
+            else:
+                mask &= self.daily[f'new_{intent.metric}_snapshots'][rows] > 0
+                value = int(np.unique(self.daily['video_id'][rows][mask]).size)
+    
+        self.hits += 1
+        return value
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'loaded': self.loaded,
+            'videos': len(self.videos.get('id', ())),
+            'daily_rows': len(self.daily.get('day', ())),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
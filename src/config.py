@@ -1,44 +1,146 @@
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-class Settings:
-    """Настройки приложения"""
-    
-    # Telegram
-    TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    
-    # Database
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    
-    # LLM
-    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-    
-    # Validation
-    @classmethod
-    def validate(cls):
-        """Проверка обязательных настроек"""
-        errors = []
-        
-        if not cls.TELEGRAM_BOT_TOKEN:
-            errors.append("TELEGRAM_BOT_TOKEN не установлен")
-        
-        if not cls.DATABASE_URL:
-            errors.append("DATABASE_URL не установлен")
-        
-        if cls.LLM_PROVIDER == "openai" and not cls.OPENAI_API_KEY:
-            errors.append("OPENAI_API_KEY не установлен для провайдера openai")
-        
-        if cls.LLM_PROVIDER == "groq" and not cls.GROQ_API_KEY:
-            errors.append("GROQ_API_KEY не установлен для провайдера groq")
-        
-        if errors:
-            raise ValueError(f"Ошибки конфигурации: {', '.join(errors)}")
-
-
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class Settings:
+    """Настройки приложения"""
+    
+    # Telegram
+    TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+    # Свой сервер Bot API (локальный telegram-bot-api или заглушка для нагрузочного теста)
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+    
+    # Режим работы: polling (один процесс) или webhook (aiohttp, можно несколько процессов на одном порту)
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))
+    # Сколько ждать завершения начатых обработчиков при остановке
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+    
+    # Database
+    DATABASE_URL = os.getenv("DATABASE_URL")
+    DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+    DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+    DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+    DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+    
+    # Ограничения на выполнение запросов
+    QUERY_STATEMENT_TIMEOUT = float(os.getenv("QUERY_STATEMENT_TIMEOUT", "10"))
+    QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "10000"))
+    QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "10000000"))
+    # Таблицы, которые может читать SQL из LLM (витрины daily_* нужны быстрому пути и примерам промпта)
+    SQL_ALLOWED_TABLES = [
+        table.strip() for table in
+        os.getenv("SQL_ALLOWED_TABLES", "videos,video_snapshots,daily_video_stats,daily_creator_stats").split(",")
+        if table.strip()
+    ]
+    # Кэш решений проверки SQL по нормализованному тексту запроса
+    SQL_VALIDATION_CACHE_SIZE = int(os.getenv("SQL_VALIDATION_CACHE_SIZE", "1000"))
+    
+    # Кэш результатов запросов (0 - выключен)
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))
+    RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "1000"))
+    RESULT_CACHE_VERSION_TTL = float(os.getenv("RESULT_CACHE_VERSION_TTL", "30"))
+    
+    # LLM
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+    OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+    # Свои адреса API (прокси, локальные заглушки); пусто - адрес SDK по умолчанию
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+    ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL") or None
+    GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+    # Провайдеры для маршрутизатора по порядку приоритета, например "groq,openai"; пусто - только LLM_PROVIDER
+    LLM_PROVIDERS = [provider.strip() for provider in os.getenv("LLM_PROVIDERS", "").split(",") if provider.strip()] \
+        or [LLM_PROVIDER]
+    # Через сколько секунд дублировать запрос следующему провайдеру, пока у текущего мало замеров для p95
+    LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+    LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+    # Circuit breaker: после стольких ошибок подряд провайдер отключается на LLM_BREAKER_COOLDOWN секунд
+    LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    
+    # HTTP-пул клиентов LLM
+    LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20"))
+    LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10"))
+    LLM_POOL_KEEPALIVE_EXPIRY = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+    
+    # Сколько самых похожих примеров класть в промпт
+    PROMPT_FEW_SHOT_EXAMPLES = int(os.getenv("PROMPT_FEW_SHOT_EXAMPLES", "3"))
+    
+    # Быстрый путь без LLM: минимальная уверенность правил (больше 1 - выключен)
+    FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "1.0"))
+    
+    # Кэш вопрос -> SQL
+    SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "1000"))
+    SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "86400"))
+    SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", "")
+    
+    # Параллельные вопросы в боте: сверх лимита пользователь получает ответ "занято"
+    BOT_MAX_CONCURRENT_PER_USER = int(os.getenv("BOT_MAX_CONCURRENT_PER_USER", "2"))
+    BOT_MAX_CONCURRENT_TOTAL = int(os.getenv("BOT_MAX_CONCURRENT_TOTAL", "50"))
+    
+    # Сколько вопросов (строк) можно прислать одним сообщением
+    BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "20"))
+    
+    # Колоночный движок в памяти для быстрого пути (нужен numpy из requirements-columnar.txt)
+    COLUMNAR_ENGINE_ENABLED = os.getenv("COLUMNAR_ENGINE_ENABLED", "false").lower() in ("1", "true", "yes")
+    COLUMNAR_REFRESH_INTERVAL = float(os.getenv("COLUMNAR_REFRESH_INTERVAL", "60"))
+    
+    # Логи и метрики
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # text - как раньше, json - одна JSON-строка на запись с полями из extra
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+    # HTTP /metrics в формате Prometheus; 0 - выключено. У воркеров вебхука порт METRICS_PORT + номер воркера
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    # Запросы дольше порога пишутся в лог slow_query вместе с EXPLAIN; 0 - выключено
+    SLOW_QUERY_LOG_MS = float(os.getenv("SLOW_QUERY_LOG_MS", "0"))
+    
+    # Validation
+    @classmethod
+    def validate(cls):
+        """Проверка обязательных настроек"""
+        errors = []
+        
+        if not cls.TELEGRAM_BOT_TOKEN:
+            errors.append("TELEGRAM_BOT_TOKEN не установлен")
+        
+        if not cls.DATABASE_URL:
+            errors.append("DATABASE_URL не установлен")
+        
+        providers = set(cls.LLM_PROVIDERS) | {cls.LLM_PROVIDER}
+        
+        if "openai" in providers and not cls.OPENAI_API_KEY:
+            errors.append("OPENAI_API_KEY не установлен для провайдера openai")
+        
+        if "groq" in providers and not cls.GROQ_API_KEY:
+            errors.append("GROQ_API_KEY не установлен для провайдера groq")
+        
+        if "anthropic" in providers and not cls.ANTHROPIC_API_KEY:
+            errors.append("ANTHROPIC_API_KEY не установлен для провайдера anthropic")
+        
+        unknown = providers - {"openai", "anthropic", "groq", "ollama"}
+        if unknown:
+            errors.append(f"Неизвестные LLM провайдеры: {', '.join(sorted(unknown))}")
+        
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            errors.append(f"BOT_MODE должен быть polling или webhook, а не {cls.BOT_MODE}")
+        
+        if errors:
+            raise ValueError(f"Ошибки конфигурации: {', '.join(errors)}")
+
+
 settings = Settings()
\ No newline at end of file
@@ -1,60 +1,425 @@
-import asyncpg
-from typing import Any, List, Optional
-import logging
-
-logger = logging.getLogger(__name__)
-
-
-class Database:
-    def __init__(self, connection_url: str):
-        self.connection_url = connection_url
-        self.pool: Optional[asyncpg.Pool] = None
-    
-    async def connect(self):
-        """Создание пула подключений"""
-        self.pool = await asyncpg.create_pool(
-            self.connection_url,
-            min_size=1,
-            max_size=10,
-            command_timeout=60
-        )
-        logger.info("Database pool created")
-    
-    async def execute_query(self, sql: str) -> Any:
-        """Выполнение SQL запроса"""
-        if not self.pool:
-            await self.connect()
-        
-        async with self.pool.acquire() as connection:
-            try:
-                
-                sql_lower = sql.lower().strip()
-                dangerous_keywords = ['drop', 'delete', 'truncate', 'update', 'insert']
-                
-                if any(keyword in sql_lower for keyword in dangerous_keywords):
-                    
-                    if not (sql_lower.startswith('delete from') or 
-                           sql_lower.startswith('update ') or 
-                           sql_lower.startswith('insert into')):
-                        raise ValueError("Запрещенная операция")
-                
-                
-                if sql_lower.startswith("select"):
-                    result = await connection.fetch(sql)
-                    if result and len(result) > 0:
-                        return result
-                    else:
-                        return None
-                else:
-                    result = await connection.execute(sql)
-                    return result
-                    
-            except Exception as e:
-                logger.error(f"Database error: {str(e)}. SQL: {sql}")
-                raise
-    
-    async def close(self):
-        """Закрытие пула подключений"""
-        if self.pool:
-            await self.pool.close()
-            logger.info("Database pool closed")
\ No newline at end of file
+import asyncio
+import asyncpg
+import json
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from config import settings
+from metrics import Histogram, registry
+from sql_validator import validator
+
+logger = logging.getLogger(__name__)
+# Отдельный логгер, чтобы медленные запросы можно было направить в свой файл
+slow_query_logger = logging.getLogger("slow_query")
+
+
+DATA_VERSION_CHANNEL = "data_version"
+
+# Функции, из-за которых результат зависит от момента выполнения, а не только от данных
+VOLATILE_SQL = re.compile(r'\b(now|current_date|current_timestamp|localtimestamp|clock_timestamp|random)\b')
+SQL_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+_MISS = object()
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Приведение SQL к каноническому виду: регистр и пробелы вне строковых литералов"""
+    parts = SQL_STRING_LITERAL.split(sql.strip().rstrip(';').strip())
+    canonical = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            canonical.append(part)
+        else:
+            canonical.append(re.sub(r'\s+', ' ', part.lower()))
+    return ''.join(canonical).strip()
+
+
+class QueryResultCache:
+    """LRU-кэш результатов SELECT, ключ - канонический SQL и версия данных"""
+    
+    def __init__(self, max_size: int = 1000, max_rows: int = 1000):
+        self.max_size = max_size
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def make_key(self, sql: str, data_version: Optional[int], args: Tuple = (),
+                 kind: str = 'rows') -> Optional[Tuple]:
+        if data_version is None:
+            return None
+        canonical = canonicalize_sql(sql)
+        if VOLATILE_SQL.search(SQL_STRING_LITERAL.sub("''", canonical)):
+            return None
+        return canonical, args, kind, data_version
+    
+    def get(self, key: Tuple) -> Any:
+        result = self._entries.get(key, _MISS)
+        if result is _MISS:
+            self.misses += 1
+            return _MISS
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+    
+    def put(self, key: Tuple, result: Any):
+        if isinstance(result, list) and len(result) > self.max_rows:
+            return
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+class TemplateConnection(asyncpg.Connection):
+    """Соединение пула с именованными подготовленными запросами"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._templates: Dict[str, Any] = {}
+    
+    async def prepare_template(self, name: str, sql: str, refresh: bool = False):
+        """Подготовленный запрос шаблона; план строится один раз на соединение"""
+        statement = None if refresh else self._templates.get(name)
+        if statement is None:
+            statement = await self.prepare(sql)
+            self._templates[name] = statement
+        return statement
+
+
+class Database:
+    def __init__(self, connection_url: str, replica_url: Optional[str] = None):
+        self.connection_url = connection_url
+        # Аналитические SELECT можно отправлять на реплику, чтобы не мешать записи загрузчика
+        self.replica_url = replica_url if replica_url is not None else settings.DATABASE_REPLICA_URL
+        self.pool: Optional[asyncpg.Pool] = None
+        self.replica_pool: Optional[asyncpg.Pool] = None
+        # Гистограммы живут в общем реестре метрик и попадают в /metrics
+        self.acquire_wait = registry.histogram('pool_acquire')
+        self.query_latency: Dict[str, Histogram] = {}
+        self._background_tasks: set = set()
+        self.in_use = 0
+        self.max_in_use = 0
+        self.templates: Dict[str, str] = {}
+        self.result_cache: Optional[QueryResultCache] = None
+        if settings.RESULT_CACHE_SIZE > 0:
+            self.result_cache = QueryResultCache(
+                max_size=settings.RESULT_CACHE_SIZE,
+                max_rows=settings.RESULT_CACHE_MAX_ROWS
+            )
+        self._data_version: Optional[int] = None
+        self._data_version_checked = 0.0
+        self._listener: Optional[asyncpg.Connection] = None
+    
+    async def _create_pool(self, url: str) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            url,
+            min_size=settings.DB_POOL_MIN_SIZE,
+            max_size=settings.DB_POOL_MAX_SIZE,
+            command_timeout=settings.DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=settings.DB_POOL_MAX_INACTIVE_LIFETIME,
+            connection_class=TemplateConnection,
+            init=self._init_connection,
+            # Серверный лимит: неудачный запрос от LLM не держит соединение пула.
+            # Бот только читает: любая транзакция на соединениях пула - только для чтения
+            server_settings={
+                'statement_timeout': str(int(settings.QUERY_STATEMENT_TIMEOUT * 1000)),
+                'default_transaction_read_only': 'on',
+            }
+        )
+    
+    async def _init_connection(self, connection: TemplateConnection):
+        """Прогрев нового соединения: шаблоны подготавливаются заранее, а не на первом вопросе"""
+        for name, sql in self.templates.items():
+            try:
+                await connection.prepare_template(name, sql)
+            except asyncpg.PostgresError as e:
+                logger.warning("Failed to prepare template %s: %s", name, e)
+    
+    async def connect(self):
+        """Создание пула подключений (min_size соединений открывается сразу)"""
+        self.pool = await self._create_pool(self.connection_url)
+        logger.info(
+            "Database pool created (min_size=%d, max_size=%d)", settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE
+        )
+        if self.replica_url:
+            self.replica_pool = await self._create_pool(self.replica_url)
+            logger.info("Replica pool created for read-only queries")
+        
+        if self.result_cache is not None:
+            await self._listen_data_version()
+    
+    @asynccontextmanager
+    async def acquire(self, read_only: bool = False):
+        """Соединение из пула (для чтения - из пула реплики) с учетом ожидания и занятости"""
+        pool = self.replica_pool if read_only and self.replica_pool is not None else self.pool
+        started = time.monotonic()
+        async with pool.acquire() as connection:
+            registry.observe('pool_acquire', time.monotonic() - started)
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            try:
+                yield connection
+            finally:
+                self.in_use -= 1
+    
+    def _observe_query(self, kind: str, started: float, sql: Optional[str] = None, args: Tuple = ()):
+        elapsed = time.monotonic() - started
+        self.query_latency.setdefault(kind, registry.histogram('query_execution', kind=kind))
+        registry.observe('query_execution', elapsed, kind=kind)
+        if sql is not None and settings.SLOW_QUERY_LOG_MS > 0 and elapsed * 1000 >= settings.SLOW_QUERY_LOG_MS:
+            registry.inc('slow_queries', kind=kind)
+            # EXPLAIN снимается в фоне, ответ пользователю не ждет
+            task = asyncio.create_task(self._log_slow_query(sql, args, elapsed))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+    
+    async def _log_slow_query(self, sql: str, args: Tuple, elapsed: float):
+        try:
+            async with self.acquire(read_only=True) as connection:
+                rows = await connection.fetch(f"EXPLAIN {sql}", *args)
+            plan = '\n'.join(row[0] for row in rows)
+        except Exception as e:
+            plan = f"EXPLAIN failed: {e}"
+        slow_query_logger.warning(
+            "Slow query %.3fs: %s params=%r\n%s", elapsed, sql, args, plan,
+            extra={'duration': elapsed, 'sql': sql}
+        )
+    
+    def gauges(self) -> Dict[str, float]:
+        """Текущие значения для /metrics"""
+        gauges = {'db_connections_in_use': self.in_use, 'db_connections_max_in_use': self.max_in_use}
+        if self.pool is not None:
+            gauges['db_pool_size'] = self.pool.get_size()
+        if self.result_cache is not None:
+            gauges['result_cache_hits'] = self.result_cache.hits
+            gauges['result_cache_misses'] = self.result_cache.misses
+        gauges['sql_validation_cache_hits'] = validator.hits
+        gauges['sql_validation_cache_misses'] = validator.misses
+        return gauges
+    
+    def stats(self) -> Dict[str, Any]:
+        """Состояние пула, ожидание соединений и латентность запросов по видам"""
+        stats: Dict[str, Any] = {
+            'in_use': self.in_use,
+            'max_in_use': self.max_in_use,
+            'acquire_wait': self.acquire_wait.snapshot(),
+            'query_latency': {kind: histogram.snapshot() for kind, histogram in self.query_latency.items()},
+        }
+        for name, pool in (('pool', self.pool), ('replica_pool', self.replica_pool)):
+            if pool is not None:
+                stats[name] = {
+                    'size': pool.get_size(),
+                    'idle': pool.get_idle_size(),
+                    'min_size': pool.get_min_size(),
+                    'max_size': pool.get_max_size(),
+                }
+        if self.result_cache is not None:
+            stats['result_cache'] = self.result_cache.stats()
+        return stats
+    
+    async def _listen_data_version(self):
+        """Подписка на NOTIFY от загрузчика, чтобы не опрашивать версию данных
+        
+        С репликой версия читается с нее же опросом: NOTIFY приходит с мастера раньше,
+        чем реплика догонит данные, и в кэш попал бы старый результат под новой версией.
+        """
+        if self.replica_pool is not None:
+            await self._refresh_data_version()
+            return
+        try:
+            self._listener = await asyncpg.connect(self.connection_url)
+            await self._listener.add_listener(DATA_VERSION_CHANNEL, self._on_data_version)
+        except Exception as e:
+            logger.warning("Data version listener is not available: %s", e)
+            self._listener = None
+        await self._refresh_data_version()
+    
+    def _on_data_version(self, connection, pid, channel, payload):
+        try:
+            self._set_data_version(int(payload))
+        except ValueError:
+            self._data_version_checked = 0.0
+    
+    def _set_data_version(self, version: Optional[int]):
+        if version != self._data_version and self.result_cache is not None:
+            self.result_cache.clear()
+            logger.info("Data version changed: %s -> %s", self._data_version, version)
+        self._data_version = version
+        self._data_version_checked = time.monotonic()
+    
+    async def _refresh_data_version(self):
+        try:
+            async with self.acquire(read_only=True) as connection:
+                version = await connection.fetchval(
+                    "SELECT version FROM data_version WHERE id = 1"
+                )
+        except asyncpg.UndefinedTableError:
+            version = None
+        self._set_data_version(version)
+    
+    async def get_data_version(self) -> Optional[int]:
+        """Текущая версия данных; без LISTEN перечитывается не чаще раза в RESULT_CACHE_VERSION_TTL"""
+        if self._listener is not None and not self._listener.is_closed() and self._data_version is not None:
+            return self._data_version
+        if time.monotonic() - self._data_version_checked >= settings.RESULT_CACHE_VERSION_TTL:
+            await self._refresh_data_version()
+        return self._data_version
+    
+    async def _cache_lookup(self, sql: str, args: Tuple, kind: str) -> Tuple[Optional[Tuple], Any]:
+        """Ключ кэша результатов и закэшированное значение (или _MISS)"""
+        if self.result_cache is None:
+            return None, _MISS
+        cache_key = self.result_cache.make_key(sql, await self.get_data_version(), args, kind)
+        if cache_key is None:
+            return None, _MISS
+        return cache_key, self.result_cache.get(cache_key)
+    
+    def _check_sql(self, sql: str):
+        """Только один читающий SELECT по разрешенным таблицам (SQLValidationError иначе)"""
+        with registry.span('sql_validation', step='parse'):
+            validator.validate(sql)
+    
+    async def _check_cost(self, connection, sql: str, args: Tuple):
+        """Отказ от запроса, если оценка стоимости плана больше QUERY_MAX_COST"""
+        if settings.QUERY_MAX_COST <= 0:
+            return
+        plan = json.loads(await connection.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args))
+        cost = plan[0]['Plan']['Total Cost']
+        if cost > settings.QUERY_MAX_COST:
+            raise ValueError(
+                f"Слишком тяжелый запрос: оценка стоимости {cost:.0f} больше {settings.QUERY_MAX_COST:.0f}"
+            )
+    
+    async def execute_query(self, sql: str, *args: Any) -> Any:
+        """Выполнение SELECT в транзакции только для чтения (args - значения параметров $1, $2, ...)"""
+        if not self.pool:
+            await self.connect()
+        
+        self._check_sql(sql)
+        
+        cache_key, cached = await self._cache_lookup(sql, args, 'rows')
+        if cached is not _MISS:
+            return cached
+        
+        async with self.acquire(read_only=True) as connection:
+            try:
+                started = time.monotonic()
+                # Не больше QUERY_MAX_ROWS строк в памяти, даже если запрос без агрегации
+                async with connection.transaction(readonly=True):
+                    cursor = await connection.cursor(sql, *args)
+                    result = await cursor.fetch(settings.QUERY_MAX_ROWS + 1)
+                self._observe_query('rows', started, sql, args)
+            except Exception as e:
+                logger.error("Database error: %s. SQL: %s", e, sql)
+                raise
+        
+        if len(result) > settings.QUERY_MAX_ROWS:
+            logger.warning("Result truncated to %d rows. SQL: %s", settings.QUERY_MAX_ROWS, sql)
+            result = result[:settings.QUERY_MAX_ROWS]
+        if not result:
+            result = None
+        if cache_key is not None:
+            self.result_cache.put(cache_key, result)
+        return result
+    
+    async def fetch_scalar(self, sql: str, *args: Any) -> Any:
+        """Одно значение (первая колонка первой строки) для SELECT из LLM
+        
+        Перед выполнением SQL проходит проверку валидатора, план - по EXPLAIN; с сервера забирается одна строка.
+        """
+        if not self.pool:
+            await self.connect()
+        
+        self._check_sql(sql)
+        
+        cache_key, cached = await self._cache_lookup(sql, args, 'scalar')
+        if cached is not _MISS:
+            return cached
+        
+        async with self.acquire(read_only=True) as connection:
+            try:
+                with registry.span('sql_validation', step='explain'):
+                    await self._check_cost(connection, sql, args)
+                started = time.monotonic()
+                value = await connection.fetchval(sql, *args)
+                self._observe_query('scalar', started, sql, args)
+            except Exception as e:
+                logger.error("Database error: %s. SQL: %s", e, sql)
+                raise
+        
+        if cache_key is not None:
+            self.result_cache.put(cache_key, value)
+        return value
+    
+    def register_templates(self, templates: Dict[str, str]):
+        """Регистрация именованных SQL-шаблонов для execute_template"""
+        self.templates.update(templates)
+    
+    async def _run_template(self, name: str, args: Tuple, scalar: bool) -> Any:
+        sql = self.templates.get(name)
+        if sql is None:
+            raise ValueError(f"Unknown SQL template: {name}")
+        
+        if not self.pool:
+            await self.connect()
+        
+        cache_key, cached = await self._cache_lookup(sql, args, 'scalar' if scalar else 'rows')
+        if cached is not _MISS:
+            return cached
+        
+        async with self.acquire(read_only=True) as connection:
+            try:
+                started = time.monotonic()
+                statement = await connection.prepare_template(name, sql)
+                try:
+                    result = await (statement.fetchval(*args) if scalar else statement.fetch(*args))
+                except asyncpg.InvalidCachedStatementError:
+                    # Схема изменилась после подготовки запроса
+                    statement = await connection.prepare_template(name, sql, refresh=True)
+                    result = await (statement.fetchval(*args) if scalar else statement.fetch(*args))
+                self._observe_query('template', started, sql, args)
+            except Exception as e:
+                logger.error("Database error: %s. Template: %s, args: %s", e, name, args)
+                raise
+        
+        if not scalar and not result:
+            result = None
+        if cache_key is not None:
+            self.result_cache.put(cache_key, result)
+        return result
+    
+    async def execute_template(self, name: str, *args: Any) -> Any:
+        """Выполнение зарегистрированного шаблона подготовленным запросом"""
+        return await self._run_template(name, args, scalar=False)
+    
+    async def fetch_template_scalar(self, name: str, *args: Any) -> Any:
+        """Одно значение из зарегистрированного шаблона"""
+        return await self._run_template(name, args, scalar=True)
+    
+    async def close(self):
+        """Закрытие пула подключений"""
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        if self.replica_pool:
+            await self.replica_pool.close()
+        if self.pool:
+            await self.pool.close()
+            logger.info("Database pool closed")
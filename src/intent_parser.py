@@ -0,0 +1,268 @@
+import re
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import registry
+
+
+# Метрика в вопросе -> префикс колонок (views_count, delta_views_count, new_views_snapshots)
+METRIC_WORDS = {
+    'просмотров': 'views', 'просмотры': 'views',
+    'лайков': 'likes', 'лайки': 'likes',
+    'комментариев': 'comments', 'комментарии': 'comments',
+    'жалоб': 'reports', 'жалобы': 'reports',
+}
+
+_METRIC = '(?P<metric>' + '|'.join(METRIC_WORDS) + ')'
+_DATES = r'(?P<dates><single>|<range>)'
+_CREATOR = r'креатора с id <creator_id>'
+
+# Шаблоны работают по нормализованному вопросу (LLMSQLGenerator._normalize_question):
+# даты, id креатора и числа в нем уже заменены плейсхолдерами
+# Порядок - от более специфичных шаблонов к общим: при равной уверенности побеждает первый
+INTENT_PATTERNS = [
+    ('videos_over_threshold', re.compile(
+        rf'сколько (всего )?видео( у {_CREATOR})? (набрало|набрали|получило|получили|имеет|имеют) '
+        rf'(больше|более|свыше) <(?P<threshold>n\d+)> {_METRIC}'
+    )),
+    ('growth', re.compile(
+        rf'на сколько {_METRIC}( в сумме| всего)? выросли (все )?видео( {_CREATOR})?( за)? {_DATES}'
+    )),
+    ('videos_with_growth', re.compile(
+        rf'сколько разных видео( {_CREATOR})? получали новые {_METRIC}( за)? {_DATES}'
+    )),
+    ('creator_videos', re.compile(
+        rf'сколько (всего )?видео у {_CREATOR}( (вышло|было опубликовано|опубликовано|опубликовал))?( {_DATES})?'
+    )),
+    ('total_videos', re.compile(
+        r'сколько (всего )?видео( есть)?( в системе| в базе)?'
+    )),
+]
+
+
+# Допустимые формы интентов: (нужна метрика, варианты "есть креатор", варианты "есть даты").
+# Формы должны совпадать с тем, что извлекают INTENT_PATTERNS: шаблон каждой формы готовится
+# на каждом соединении пула, недостижимый - лишний PREPARE
+INTENT_SHAPES = {
+    'total_videos': (False, (False,), (False,)),
+    'creator_videos': (False, (True,), (False, True)),
+    'videos_over_threshold': (True, (False, True), (False,)),
+    'growth': (True, (False, True), (True,)),
+    'videos_with_growth': (True, (False, True), (True,)),
+}
+
+
+def render_sql(sql: str, params: Tuple) -> str:
+    """Подстановка параметров $n литералами (для старого строкового API и логов)"""
+    for index in range(len(params), 0, -1):
+        value = params[index - 1]
+        if isinstance(value, date):
+            literal = f"DATE '{value.isoformat()}'"
+        else:
+            literal = str(int(value))
+        sql = re.sub(rf'\${index}(?!\d)(::date)?', literal, sql)
+    return sql
+
+
+class Intent:
+    """Распознанный тип вопроса с извлеченными параметрами"""
+    
+    def __init__(self, name: str, confidence: float, metric: Optional[str] = None,
+                 creator_id: Optional[int] = None, threshold: Optional[int] = None,
+                 start_date: Optional[date] = None, end_date: Optional[date] = None):
+        self.name = name
+        self.confidence = confidence
+        self.metric = metric
+        self.creator_id = creator_id
+        self.threshold = threshold
+        self.start_date = start_date
+        self.end_date = end_date
+    
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{key}={value!r}' for key, value in vars(self).items() if value is not None)
+        return f'Intent({fields})'
+    
+    @property
+    def template_name(self) -> str:
+        """Имя SQL-шаблона: у интентов одной формы один и тот же подготовленный запрос"""
+        parts = [self.name]
+        if self.metric:
+            parts.append(self.metric)
+        if self.creator_id is not None:
+            parts.append('creator')
+        if self.start_date is not None:
+            parts.append('dates')
+        return '_'.join(parts)
+    
+    def to_sql(self) -> Tuple[str, Tuple]:
+        """Параметризованный SQL ($1, $2, ...) и значения параметров"""
+        conditions: List[str] = []
+        params: List[Any] = []
+        
+        def param(value: Any, cast: str = '') -> str:
+            params.append(value)
+            return f'${len(params)}{cast}'
+        
+        if self.name in ('total_videos', 'creator_videos', 'videos_over_threshold'):
+            if self.threshold is not None:
+                conditions.append(f'{self.metric}_count > {param(self.threshold)}')
+            if self.creator_id is not None:
+                conditions.append(f'creator_id = {param(self.creator_id)}')
+            if self.start_date is not None:
+                conditions.append(f'video_created_at >= {param(self.start_date, "::date")}')
+                conditions.append(f'video_created_at < {param(self.end_date, "::date")} + 1')
+            sql = 'SELECT COUNT(*) FROM videos'
+        
+        elif self.name == 'growth':
+            conditions.append(f'day BETWEEN {param(self.start_date)} AND {param(self.end_date)}')
+            if self.creator_id is not None:
+                conditions.append(f'creator_id = {param(self.creator_id)}')
+                sql = f'SELECT COALESCE(SUM(delta_{self.metric}_count), 0) FROM daily_creator_stats'
+            else:
+                sql = f'SELECT COALESCE(SUM(delta_{self.metric}_count), 0) FROM daily_video_stats'
+        
+        elif self.name == 'videos_with_growth':
+            conditions.append(f'day BETWEEN {param(self.start_date)} AND {param(self.end_date)}')
+            conditions.append(f'new_{self.metric}_snapshots > 0')
+            if self.creator_id is not None:
+                conditions.append(f'creator_id = {param(self.creator_id)}')
+            sql = 'SELECT COUNT(DISTINCT video_id) FROM daily_video_stats'
+        
+        else:
+            raise ValueError(f"Unknown intent: {self.name}")
+        
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return sql, tuple(params)
+
+
+def build_templates() -> Dict[str, str]:
+    """Каталог всех SQL-шаблонов быстрого пути: имя -> параметризованный SQL"""
+    templates = {}
+    sample_date = date(2000, 1, 1)
+    for name, (needs_metric, creator_options, dates_options) in INTENT_SHAPES.items():
+        metrics = sorted(set(METRIC_WORDS.values())) if needs_metric else [None]
+        for metric in metrics:
+            for has_creator in creator_options:
+                for has_dates in dates_options:
+                    intent = Intent(
+                        name, 1.0, metric=metric,
+                        creator_id=0 if has_creator else None,
+                        threshold=0 if name == 'videos_over_threshold' else None,
+                        start_date=sample_date if has_dates else None,
+                        end_date=sample_date if has_dates else None
+                    )
+                    templates[intent.template_name] = intent.to_sql()[0]
+    return templates
+
+
+class QueryPlan:
+    """Что выполнять в БД: SQL с параметрами и, если есть, интент, из которого он получен
+    
+    template - имя шаблона из build_templates(); такой план выполняется через
+    Database.execute_template подготовленным запросом.
+    """
+    
+    def __init__(self, sql: str, params: Tuple = (), intent: Optional[Intent] = None):
+        self.sql = sql
+        self.params = params
+        self.intent = intent
+        self.template = intent.template_name if intent is not None else None
+    
+    @classmethod
+    def from_intent(cls, intent: Intent) -> 'QueryPlan':
+        sql, params = intent.to_sql()
+        return cls(sql, params, intent)
+    
+    def literal_sql(self) -> str:
+        sql = render_sql(self.sql, self.params)
+        return sql if sql.rstrip().endswith(';') else sql + ';'
+
+
+def merge_plans(plans: List[QueryPlan]) -> QueryPlan:
+    """Несколько скалярных планов одним SELECT: каждый план - отдельный скалярный подзапрос
+    
+    Параметры перенумеровываются подряд, i-я колонка результата - ответ i-го плана.
+    """
+    columns: List[str] = []
+    params: List[Any] = []
+    for plan in plans:
+        offset = len(params)
+        sql = re.sub(r'\$(\d+)', lambda match: f'${int(match.group(1)) + offset}', plan.sql.strip().rstrip(';'))
+        columns.append(f'({sql})')
+        params.extend(plan.params)
+    return QueryPlan('SELECT ' + ', '.join(columns), tuple(params))
+
+
+class IntentParser:
+    """Быстрый путь без LLM: распознавание типовых вопросов по заранее скомпилированным шаблонам
+    
+    Полное совпадение нормализованного вопроса с шаблоном дает уверенность 1.0,
+    совпадение части вопроса - 0.5 (такой интент годится только как запасной вариант).
+    """
+    
+    def __init__(self, min_confidence: float = 1.0):
+        self.min_confidence = min_confidence
+        self.hits: Counter = Counter()
+        self.misses = 0
+    
+    def parse(self, key: str, params: Dict[str, str]) -> Optional[Intent]:
+        """Лучший интент для вопроса независимо от уверенности"""
+        best: Optional[Intent] = None
+        for name, pattern in INTENT_PATTERNS:
+            match = pattern.fullmatch(key)
+            confidence = 1.0
+            if match is None:
+                match = pattern.search(key)
+                confidence = 0.5
+            if match is None:
+                continue
+            intent = self._build_intent(name, confidence, match, params)
+            if intent is not None and (best is None or intent.confidence > best.confidence):
+                best = intent
+        return best
+    
+    def match(self, key: str, params: Dict[str, str]) -> Optional[Intent]:
+        """Интент для быстрого пути: только если уверенность не ниже min_confidence"""
+        intent = self.parse(key, params)
+        if intent is None or intent.confidence < self.min_confidence:
+            self.misses += 1
+            registry.inc('fast_path_misses')
+            return None
+        self.hits[intent.name] += 1
+        registry.inc('fast_path_hits', intent=intent.name)
+        return intent
+    
+    def stats(self) -> Dict[str, Any]:
+        return {'hits': dict(self.hits), 'misses': self.misses}
+    
+    def _build_intent(self, name: str, confidence: float, match: re.Match,
+                      params: Dict[str, str]) -> Optional[Intent]:
+        groups = match.groupdict()
+        intent = Intent(name, confidence)
+        
+        if groups.get('metric'):
+            intent.metric = METRIC_WORDS[groups['metric']]
+        if '<creator_id>' in match.group(0):
+            intent.creator_id = int(params['creator_id'])
+        if groups.get('threshold'):
+            intent.threshold = int(params[groups['threshold']])
+        if groups.get('dates'):
+            try:
+                if 'date' in params:
+                    intent.start_date = intent.end_date = date.fromisoformat(params['date'])
+                else:
+                    intent.start_date = date.fromisoformat(params['start_date'])
+                    intent.end_date = date.fromisoformat(params['end_date'])
+            except ValueError:
+                # Несуществующая дата ("31 ноября"): вопрос уходит в LLM, как и без быстрого пути
+                return None
+        
+        # Вопрос о видео креатора без id креатора - не наш шаблон
+        if name == 'creator_videos' and intent.creator_id is None:
+            return None
+        # "сколько видео" встречается почти в любом вопросе: общий подсчет только при полном совпадении
+        if name == 'total_videos' and confidence < 1.0:
+            return None
+        return intent
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+# Пока замеров меньше, p95 провайдера не считается и хедж запускается по LLM_HEDGE_DELAY
+MIN_LATENCY_SAMPLES = 20
+
+
+class ProviderStats:
+    """Скользящее окно задержек и ошибок провайдера и автомат отключения (circuit breaker)
+    
+    После failure_threshold ошибок подряд провайдер пропускается cooldown секунд.
+    Затем ему дается один пробный запрос: ошибка снова отключает его, успех сбрасывает счетчик,
+    отмена (проигранный хедж) возвращает провайдеру право на пробу.
+    """
+    
+    def __init__(self, window: int = 100, failure_threshold: int = 5, cooldown: float = 30):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+    
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+    
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.trial_running = False
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+    
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+    
+    def take_trial(self) -> bool:
+        """Доступен ли провайдер; после отключения пропускает только один пробный запрос"""
+        if not self.available():
+            return False
+        if self.consecutive_failures >= self.failure_threshold:
+            # Пока идет пробный запрос, остальные провайдера обходят
+            self.open_until = time.monotonic() + self.cooldown
+            self.trial_running = True
+        return True
+    
+    def release_trial(self):
+        """Пробный запрос отменен, не дав ответа: следующий запрос снова может стать пробным"""
+        if self.trial_running:
+            self.trial_running = False
+            self.open_until = 0.0
+    
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'available': self.available(),
+            'samples': len(self.latencies),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'error_rate': round(self.error_rate(), 3),
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class LLMRouter:
+    """Маршрутизация запросов к LLM по нескольким провайдерам с хеджированием
+    
+    Запрос уходит первому доступному провайдеру. Если он не ответил за свой p95
+    (или за hedge_delay, пока замеров мало), тот же промпт параллельно уходит
+    следующему; при ошибке следующий запускается сразу. Побеждает первый
+    валидный ответ, остальные запросы отменяются. call(provider, prompt)
+    должен вернуть готовый SQL или бросить исключение, если ответ не годится.
+    """
+    
+    def __init__(self, providers: List[str], call: Callable[[str, str], Awaitable[str]],
+                 hedge_delay: float = 5, window: int = 100, failure_threshold: int = 5, cooldown: float = 30):
+        self.providers = providers
+        self.call = call
+        self.hedge_delay = hedge_delay
+        self.stats: Dict[str, ProviderStats] = {
+            provider: ProviderStats(window, failure_threshold, cooldown) for provider in providers
+        }
+        self.hedges = 0
+        self.wins: Dict[str, int] = {provider: 0 for provider in providers}
+    
+    def _candidates(self) -> List[str]:
+        """Доступные провайдеры в порядке настроек; отключенные автоматом не получают запросов
+        
+        Состояние автомата только читается: пробный запрос резервирует launch(), когда запрос реально уходит.
+        """
+        return [provider for provider in self.providers if self.stats[provider].available()]
+    
+    def _hedge_after(self, provider: str) -> float:
+        p95 = self.stats[provider].quantile(0.95)
+        return p95 if p95 is not None else self.hedge_delay
+    
+    async def _attempt(self, provider: str, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            result = await self.call(provider, prompt)
+        except asyncio.CancelledError:
+            # Проигравший хедж не считается ошибкой провайдера
+            self.stats[provider].release_trial()
+            registry.inc('llm_requests', provider=provider, outcome='cancelled')
+            raise
+        except Exception:
+            self.stats[provider].record_failure()
+            registry.observe('llm_call', time.monotonic() - started, provider=provider, outcome='error')
+            registry.inc('llm_requests', provider=provider, outcome='error')
+            raise
+        latency = time.monotonic() - started
+        self.stats[provider].record_success(latency)
+        registry.observe('llm_call', latency, provider=provider, outcome='ok')
+        registry.inc('llm_requests', provider=provider, outcome='ok')
+        return result
+    
+    async def route(self, prompt: str) -> Tuple[str, str]:
+        """(провайдер, SQL) первого валидного ответа"""
+        candidates = self._candidates()
+        tasks: Dict[asyncio.Task, str] = {}
+        errors: List[str] = []
+        launched = 0
+        current: Optional[str] = None
+        
+        def launch() -> bool:
+            """Запрос следующему кандидату; пробу, которую уже занял параллельный запрос, пропускаем"""
+            nonlocal launched, current
+            while launched < len(candidates):
+                provider = candidates[launched]
+                launched += 1
+                if self.stats[provider].take_trial():
+                    current = provider
+                    tasks[asyncio.create_task(self._attempt(provider, prompt))] = provider
+                    return True
+            return False
+        
+        if not launch():
+            # Все провайдеры отключены: не ждем их, генератор сразу уходит в резервный план
+            registry.inc('llm_requests', outcome='breaker_open')
+            raise RuntimeError("All LLM providers are disabled by circuit breaker")
+        try:
+            while tasks:
+                timeout = self._hedge_after(current) if launched < len(candidates) else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    slow = current
+                    if launch():
+                        self.hedges += 1
+                        registry.inc('llm_hedges', provider=current)
+                        logger.info("LLM provider %s is slow, hedging to %s", slow, current)
+                    continue
+                
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.exception() is None:
+                        self.wins[provider] += 1
+                        return provider, task.result()
+                    errors.append(f"{provider}: {task.exception()}")
+                    logger.warning("LLM provider %s failed: %s", provider, task.exception())
+                
+                # Ошибка - следующий провайдер сразу, не дожидаясь хеджа
+                launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'providers': {provider: stats.snapshot() for provider, stats in self.stats.items()},
+            'hedges': self.hedges,
+            'wins': dict(self.wins),
+        }
@@ -1,230 +1,725 @@
-import json
-import re
-from typing import Dict, Any, Optional
-import openai
-from anthropic import Anthropic
-import groq
-import os
-from datetime import datetime
-
-
-class LLMSQLGenerator:
-    def __init__(self, provider: str = "openai"):
-        self.provider = provider
-        self.schema_description = self._get_schema_description()
-        
-    def _get_schema_description(self) -> str:
-        """Описание схемы данных для промпта LLM"""
-        return """
-        ## Database Schema for Video Analytics
-        
-        ### Table: videos
-        - id: BIGINT (PRIMARY KEY) - уникальный идентификатор видео
-        - creator_id: BIGINT - идентификатор креатора
-        - video_created_at: TIMESTAMP - дата и время публикации видео
-        - views_count: BIGINT - финальное количество просмотров
-        - likes_count: BIGINT - финальное количество лайков
-        - comments_count: BIGINT - финальное количество комментариев
-        - reports_count: BIGINT - финальное количество жалоб
-        - created_at, updated_at: TIMESTAMP - служебные поля
-        
-        ### Table: video_snapshots
-        - id: BIGSERIAL (PRIMARY KEY) - уникальный идентификатор снапшота
-        - video_id: BIGINT (FOREIGN KEY references videos.id) - ссылка на видео
-        - views_count, likes_count, comments_count, reports_count: BIGINT - текущие значения на момент замера
-        - delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count: BIGINT - приращение с прошлого замера
-        - created_at: TIMESTAMP - время замера (раз в час)
-        - updated_at: TIMESTAMP - служебное поле
-        
-        ### Важные моменты:
-        1. video_snapshots.created_at - это время снятия снапшота (раз в час)
-        2. videos.video_created_at - это время публикации видео
-        3. delta_* поля показывают изменение за последний час
-        4. Для подсчета "прироста за день" нужно SUM(delta_*_count) за нужную дату
-        5. Для подсчета "сколько видео получали новые просмотры" нужно COUNT(DISTINCT video_id) WHERE delta_views_count > 0
-        """
-    
-    def _extract_date_range(self, text: str) -> Dict[str, str]:
-        """Извлечение дат из русского текста"""
-        date_patterns = [
-            (r'(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})', 'single'),
-            (r'с\s+(\d{1,2})\s+по\s+(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})', 'range'),
-            (r'(\d{1,2})\s*[-–]\s*(\d{1,2})\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})', 'range'),
-        ]
-        
-        month_map = {
-            'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04',
-            'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08',
-            'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12'
-        }
-        
-        for pattern, pattern_type in date_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                if pattern_type == 'single':
-                    day, month, year = match.groups()
-                    date_str = f"{year}-{month_map[month.lower()]}-{int(day):02d}"
-                    return {'start_date': date_str, 'end_date': date_str}
-                elif pattern_type == 'range':
-                    if len(match.groups()) == 4:
-                        day1, day2, month, year = match.groups()
-                        start_date = f"{year}-{month_map[month.lower()]}-{int(day1):02d}"
-                        end_date = f"{year}-{month_map[month.lower()]}-{int(day2):02d}"
-                        return {'start_date': start_date, 'end_date': end_date}
-        
-        return {'start_date': None, 'end_date': None}
-    
-    def _build_prompt(self, user_query: str, date_info: Dict[str, str]) -> str:
-        """Строим промпт для LLM"""
-        date_context = ""
-        if date_info['start_date']:
-            if date_info['start_date'] == date_info['end_date']:
-                date_context = f"Дата: {date_info['start_date']}"
-            else:
-                date_context = f"Период: с {date_info['start_date']} по {date_info['end_date']}"
-        
-        prompt = f"""
-        {self.schema_description}
-        
-        {date_context}
-        
-        Пользовательский запрос: "{user_query}"
-        
-        Преобразуй этот запрос в единственный SQL-запрос к PostgreSQL, который вернет ОДНО число.
-        
-        ### КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
-        1. Запрос должен возвращать ТОЛЬКО одно число (одно значение, одна колонка)
-        2. Используй правильные имена таблиц и колонок из схемы выше
-        3. Учитывай логику данных:
-           - Для подсчета видео используй таблицу `videos`
-           - Для подсчета прироста (просмотров, лайков и т.д.) используй `delta_*` поля в `video_snapshots`
-           - Для фильтрации по дате публикации видео используй `videos.video_created_at`
-           - Для фильтрации по дате снятия снапшота используй `video_snapshots.created_at`
-        4. Если в запросе указана конкретная дата или период, добав соответствующие условия WHERE
-        5. Не добавляй LIMIT, OFFSET, ORDER BY если они не нужны для получения одного числа
-        6. Используй агрегатные функции: COUNT(), SUM(), AVG() когда нужно
-        7. Убедись, что JOIN выполняется правильно при работе с двумя таблицами
-        
-        ### Примеры правильных SQL-запросов:
-        1. "Сколько всего видео есть в системе?" → SELECT COUNT(*) FROM videos;
-        2. "Сколько видео у креатора с id 123 вышло с 2025-11-01 по 2025-11-05?" → SELECT COUNT(*) FROM videos WHERE creator_id = 123 AND video_created_at BETWEEN '2025-11-01' AND '2025-11-06';
-        3. "Сколько видео набрало больше 100000 просмотров?" → SELECT COUNT(*) FROM videos WHERE views_count > 100000;
-        4. "На сколько просмотров в сумме выросли все видео 2025-11-28?" → SELECT SUM(delta_views_count) FROM video_snapshots WHERE DATE(created_at) = '2025-11-28';
-        5. "Сколько разных видео получали новые просмотры 2025-11-27?" → SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = '2025-11-27' AND delta_views_count > 0;
-        
-        Верни ТОЛЬКО SQL-запрос, без пояснений, без обратных кавычек, без markdown.
-        SQL-запрос:
-        """
-        
-        return prompt
-    
-    def generate_sql(self, user_query: str) -> str:
-        """Генерация SQL из текстового запроса"""
-        # Сначала извлекаем даты
-        date_info = self._extract_date_range(user_query)
-        
-        # Строим промпт
-        prompt = self._build_prompt(user_query, date_info)
-        
-        try:
-            if self.provider == "openai":
-                client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo-preview",
-                    messages=[
-                        {"role": "system", "content": "Ты эксперт по SQL и анализу данных. Преобразуй текстовые запросы в точные SQL-запросы."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=500
-                )
-                sql = response.choices[0].message.content.strip()
-                
-            elif self.provider == "anthropic":
-                client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-                response = client.messages.create(
-                    model="claude-3-opus-20240229",
-                    max_tokens=500,
-                    temperature=0.1,
-                    system="Ты эксперт по SQL и анализу данных. Преобразуй текстовые запросы в точные SQL-запросы.",
-                    messages=[
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                sql = response.content[0].text.strip()
-                
-            elif self.provider == "groq":
-                client = groq.Groq(api_key=os.getenv("GROQ_API_KEY"))
-                response = client.chat.completions.create(
-                    model="mixtral-8x7b-32768",
-                    messages=[
-                        {"role": "system", "content": "Ты эксперт по SQL и анализу данных. Преобразуй текстовые запросы в точные SQL-запросы."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1,
-                    max_tokens=500
-                )
-                sql = response.choices[0].message.content.strip()
-                
-            elif self.provider == "ollama":
-                # Для локальной LLM
-                import requests
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
-                    json={
-                        "model": "codellama:13b",
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {"temperature": 0.1}
-                    }
-                )
-                sql = response.json()["response"].strip()
-            
-            else:
-                raise ValueError(f"Unsupported provider: {self.provider}")
-            
-            # Очистка SQL от markdown и лишних символов
-            sql = sql.replace("```sql", "").replace("```", "").strip()
-            sql = sql.split(';')[0] + ';' if ';' in sql else sql + ';'
-            
-            return sql
-            
-        except Exception as e:
-            # Fallback на правила для простых запросов
-            return self._fallback_sql_generation(user_query, date_info)
-    
-    def _fallback_sql_generation(self, user_query: str, date_info: Dict[str, str]) -> str:
-        """Резервная логика генерации SQL если LLM недоступна"""
-        query_lower = user_query.lower()
-        
-        # Базовые шаблоны
-        if "сколько всего видео" in query_lower:
-            return "SELECT COUNT(*) FROM videos;"
-        
-        elif "сколько видео у креатора" in query_lower:
-            # Извлекаем creator_id
-            match = re.search(r'креатора\s+с\s+id\s+(\d+)', user_query, re.IGNORECASE)
-            if match:
-                creator_id = match.group(1)
-                if date_info['start_date']:
-                    return f"SELECT COUNT(*) FROM videos WHERE creator_id = {creator_id} AND DATE(video_created_at) BETWEEN '{date_info['start_date']}' AND '{date_info['end_date']}';"
-                else:
-                    return f"SELECT COUNT(*) FROM videos WHERE creator_id = {creator_id};"
-        
-        elif "больше" in query_lower and "просмотров" in query_lower:
-            # Извлекаем число
-            match = re.search(r'больше\s+([\d\s]+)\s+просмотров', user_query)
-            if match:
-                number = match.group(1).replace(' ', '')
-                return f"SELECT COUNT(*) FROM videos WHERE views_count > {number};"
-        
-        elif "на сколько просмотров" in query_lower and "выросли" in query_lower:
-            if date_info['start_date']:
-                return f"SELECT SUM(delta_views_count) FROM video_snapshots WHERE DATE(created_at) = '{date_info['start_date']}';"
-        
-        elif "сколько разных видео получали новые просмотры" in query_lower:
-            if date_info['start_date']:
-                return f"SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = '{date_info['start_date']}' AND delta_views_count > 0;"
-        
-        # Дефолтный запрос
-        return "SELECT 'Запрос не распознан' as result;"
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple
+import aiohttp
+import os
+from datetime import date, datetime, timedelta
+
+from config import settings
+from intent_parser import IntentParser, QueryPlan
+from llm_router import LLMRouter
+from metrics import registry
+from sql_validator import SQLValidationError, first_statement, validator
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+
+SYSTEM_PROMPT = "Ты эксперт по SQL и анализу данных. Преобразуй текстовые запросы в точные SQL-запросы."
+
+# Кэширование префикса промпта у Anthropic (блоки с cache_control)
+ANTHROPIC_CACHE_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+MONTHS = 'января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря'
+
+MONTH_MAP = {
+    'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04',
+    'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08',
+    'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12'
+}
+
+# Диапазоны проверяются раньше одиночной даты: иначе "с 1 по 5 ноября 2025"
+# распознается как "5 ноября 2025"
+DATE_PATTERNS = [
+    (re.compile(rf'с\s+(\d{{1,2}})\s+по\s+(\d{{1,2}})\s+({MONTHS})\s+(\d{{4}})', re.IGNORECASE), 'range'),
+    (re.compile(rf'(\d{{1,2}})\s*[-–]\s*(\d{{1,2}})\s+({MONTHS})\s+(\d{{4}})', re.IGNORECASE), 'range'),
+    (re.compile(rf'(\d{{1,2}})\s+({MONTHS})\s+(\d{{4}})', re.IGNORECASE), 'single'),
+]
+
+# Примеры для промпта: в запрос попадают только самые похожие на вопрос (LLMSQLGenerator._select_examples)
+FEW_SHOT_EXAMPLES = [
+    ("Сколько всего видео есть в системе?",
+     "SELECT COUNT(*) FROM videos;"),
+    ("Сколько видео у креатора с id 123 вышло с 1 по 5 ноября 2025?",
+     "SELECT COUNT(*) FROM videos WHERE creator_id = 123 AND video_created_at >= DATE '2025-11-01' AND video_created_at < DATE '2025-11-06';"),
+    ("Сколько видео набрало больше 100000 просмотров?",
+     "SELECT COUNT(*) FROM videos WHERE views_count > 100000;"),
+    ("На сколько просмотров в сумме выросли все видео 28 ноября 2025?",
+     "SELECT COALESCE(SUM(delta_views_count), 0) FROM daily_video_stats WHERE day = DATE '2025-11-28';"),
+    ("Сколько разных видео получали новые просмотры 27 ноября 2025?",
+     "SELECT COUNT(*) FROM daily_video_stats WHERE day = DATE '2025-11-27' AND new_views_snapshots > 0;"),
+    ("На сколько лайков выросли видео креатора с id 42 с 1 по 3 ноября 2025?",
+     "SELECT COALESCE(SUM(delta_likes_count), 0) FROM daily_creator_stats WHERE creator_id = 42 AND day BETWEEN DATE '2025-11-01' AND DATE '2025-11-03';"),
+    ("Какое среднее число комментариев у видео креатора с id 7?",
+     "SELECT COALESCE(AVG(comments_count), 0) FROM videos WHERE creator_id = 7;"),
+]
+
+
+def next_day(date_str: str) -> Optional[str]:
+    """YYYY-MM-DD следующего дня: исключающая верхняя граница периода; None - несуществующая дата"""
+    try:
+        return (date.fromisoformat(date_str) + timedelta(days=1)).isoformat()
+    except ValueError:
+        return None
+
+
+def compact_prompt(text: str) -> str:
+    """Промпт без отступов и пустых строк: меньше входных токенов, тот же смысл"""
+    return '\n'.join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+
+CREATOR_ID_PATTERN = re.compile(r'креатора\s+с\s+id\s+(\d+)', re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r'\d+(?:\s\d{3})*')
+SQL_DATE_LITERAL = re.compile(r'\d{4}-\d{2}-\d{2}')
+SQL_NUMBER_LITERAL = re.compile(r'\b\d+\b')
+# Числа, которые могут остаться в шаблоне как есть (COALESCE(..., 0), + 1 и т.п.)
+TEMPLATE_CONSTANTS = ('0', '1')
+
+# Колонка, обернутая в приведение к дате: DATE(col), col::date, CAST(col AS DATE)
+_DATE_CAST = r"(?:DATE\s*\(\s*(?P<{0}1>[\w.]+)\s*\)|CAST\s*\(\s*(?P<{0}2>[\w.]+)\s+AS\s+DATE\s*\)|(?P<{0}3>[\w.]+)\s*::\s*date\b)"
+_DATE_LITERAL = r"(?:DATE\s+)?'(?P<{0}>\d{{4}}-\d{{2}}-\d{{2}})'(?:\s*::\s*date\b)?"
+# Литерал должен заканчивать предикат: "'2025-11-28'::date + 1" или "- INTERVAL ..." не переписываются
+_PREDICATE_END = r"(?=\s*(?:\)|;|$|(?:AND|OR|GROUP|ORDER|LIMIT)\b))"
+DATE_BETWEEN_PREDICATE = re.compile(
+    _DATE_CAST.format('col') + r"\s+BETWEEN\s+" + _DATE_LITERAL.format('start') + r"\s+AND\s+"
+    + _DATE_LITERAL.format('end') + _PREDICATE_END,
+    re.IGNORECASE
+)
+DATE_COMPARE_PREDICATE = re.compile(
+    _DATE_CAST.format('col') + r"\s*(?P<op>>=|<=|=|>|<)\s*" + _DATE_LITERAL.format('date') + _PREDICATE_END,
+    re.IGNORECASE
+)
+
+
+class QuestionSQLCache:
+    """LRU-кэш SQL-шаблонов по нормализованному вопросу с TTL
+    
+    Значения из вопроса (даты, id креатора, числа) хранятся в шаблоне как
+    плейсхолдеры <<name>> и подставляются заново при попадании в кэш.
+    """
+    
+    def __init__(self, max_size: int = 1000, ttl: float = 86400, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+    
+    def get(self, key: str, params: Dict[str, str]) -> Optional[str]:
+        params = self._template_params(params)
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry['created'] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._render(entry['template'], params)
+    
+    def put(self, key: str, sql: str, params: Dict[str, str]):
+        template = self._to_template(sql, self._template_params(params))
+        if template is None:
+            return
+        
+        self._entries[key] = {'template': template, 'created': time.time()}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+    
+    @staticmethod
+    def _template_params(params: Dict[str, str]) -> Dict[str, str]:
+        """Параметры вопроса плюс date_end - день после конца периода (граница col < DATE '...')"""
+        end = params.get('date') or params.get('end_date')
+        date_end = next_day(end) if end else None
+        if date_end is None:
+            return params
+        return dict(params, date_end=date_end)
+    
+    def _to_template(self, sql: str, params: Dict[str, str]) -> Optional[str]:
+        """Замена значений параметров плейсхолдерами; None если SQL нельзя параметризовать однозначно"""
+        values = list(params.values())
+        if len(set(values)) != len(values):
+            return None
+        
+        # Значение, совпавшее с допустимой константой, нельзя отличить от нее в SQL:
+        # "креатора с id 1" превратил бы и "+ 1" в <<creator_id>>
+        if any(value in TEMPLATE_CONSTANTS for value in values):
+            return None
+        
+        template = sql
+        unused = set()
+        for name, value in params.items():
+            pattern = re.compile(rf'(?<![\w-]){re.escape(value)}(?![\w-])')
+            template, count = pattern.subn(f'<<{name}>>', template)
+            # Каждый параметр взят из одного места вопроса: лишние вхождения в SQL -
+            # другие литералы, случайно совпавшие с ним по значению
+            if count > 1:
+                return None
+            if count == 0:
+                unused.add(name)
+        
+        # Конец периода входит в SQL либо самим днем (BETWEEN, <=), либо следующим (< <<date_end>>)
+        if 'date_end' not in unused:
+            unused.discard('end_date')
+        unused.discard('date_end')
+        if unused:
+            return None
+        
+        # Оставшиеся литералы могли быть вычислены LLM из параметров (например, дата + 1 день)
+        if SQL_DATE_LITERAL.search(template):
+            return None
+        if any(number not in TEMPLATE_CONSTANTS for number in SQL_NUMBER_LITERAL.findall(template)):
+            return None
+        
+        return template
+    
+    def _render(self, template: str, params: Dict[str, str]) -> Optional[str]:
+        sql = template
+        for name, value in params.items():
+            sql = sql.replace(f'<<{name}>>', value)
+        if '<<' in sql:
+            return None
+        return sql
+    
+    def load(self):
+        """Загрузка кэша с диска, чтобы рестарт не начинался с пустого кэша"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, entry in entries.items():
+                if now - entry['created'] <= self.ttl:
+                    self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            logger.info("SQL cache loaded: %d entries", len(self._entries))
+        except Exception as e:
+            logger.warning("Failed to load SQL cache from %s: %s", self.path, e)
+    
+    def save(self):
+        """Сохранение кэша на диск"""
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning("Failed to save SQL cache to %s: %s", self.path, e)
+
+
+class LLMSQLGenerator:
+    def __init__(self, provider: str = "openai", timeout: Optional[float] = None,
+                 max_concurrency: Optional[int] = None):
+        self.provider = provider
+        self.schema_description = self._get_schema_description()
+        # Неизменная часть промпта собирается один раз и всегда идет первой (system):
+        # одинаковый префикс попадает в кэш промптов провайдера
+        self.static_prompt = self._build_static_prompt()
+        self.few_shot_examples = settings.PROMPT_FEW_SHOT_EXAMPLES
+        self._example_words = [
+            set(self._normalize_question(question, self._extract_date_range(question))[0].split())
+            for question, _ in FEW_SHOT_EXAMPLES
+        ]
+        self.timeout = timeout or settings.LLM_TIMEOUT
+        # Ограничение числа одновременных обращений к LLM из event loop
+        self._llm_semaphore = asyncio.Semaphore(max_concurrency or settings.LLM_MAX_CONCURRENCY)
+        # Долгоживущие клиенты провайдеров, создаются лениво при первом обращении
+        self._async_clients: Dict[str, Any] = {}
+        # HTTP-пулы асинхронных SDK-клиентов: через них warm_up() заранее открывает соединения
+        self._async_http: Dict[str, Any] = {}
+        self.intent_parser = IntentParser(min_confidence=settings.FAST_PATH_MIN_CONFIDENCE)
+        # Асинхронный путь ходит к провайдерам через маршрутизатор: хедж медленных, обход падающих
+        providers = [provider] + [name for name in settings.LLM_PROVIDERS if name != provider]
+        self.router = LLMRouter(
+            providers,
+            call=self._acall_valid_sql,
+            hedge_delay=settings.LLM_HEDGE_DELAY,
+            window=settings.LLM_ROUTER_WINDOW,
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            cooldown=settings.LLM_BREAKER_COOLDOWN
+        )
+        self.sql_cache = QuestionSQLCache(
+            max_size=settings.SQL_CACHE_SIZE,
+            ttl=settings.SQL_CACHE_TTL,
+            path=settings.SQL_CACHE_PATH or None
+        )
+    
+    def _get_schema_description(self) -> str:
+        """Описание схемы данных для промпта LLM"""
+        return """
+        ## Database Schema for Video Analytics
+        
+        ### Table: videos
+        - id: BIGINT (PRIMARY KEY) - уникальный идентификатор видео
+        - creator_id: BIGINT - идентификатор креатора
+        - video_created_at: TIMESTAMP - дата и время публикации видео
+        - views_count: BIGINT - финальное количество просмотров
+        - likes_count: BIGINT - финальное количество лайков
+        - comments_count: BIGINT - финальное количество комментариев
+        - reports_count: BIGINT - финальное количество жалоб
+        - created_at, updated_at: TIMESTAMP - служебные поля
+        
+        ### Table: video_snapshots
+        - id: BIGSERIAL (PRIMARY KEY) - уникальный идентификатор снапшота
+        - video_id: BIGINT (FOREIGN KEY references videos.id) - ссылка на видео
+        - views_count, likes_count, comments_count, reports_count: BIGINT - текущие значения на момент замера
+        - delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count: BIGINT - приращение с прошлого замера
+        - created_at: TIMESTAMP - время замера (раз в час)
+        - updated_at: TIMESTAMP - служебное поле
+        
+        ### Table: daily_video_stats (дневные агрегаты снапшотов по видео)
+        - day: DATE - день замера (DATE(video_snapshots.created_at))
+        - video_id: BIGINT, creator_id: BIGINT
+        - delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count: BIGINT - приращение за день
+        - new_views_snapshots, new_likes_snapshots, new_comments_snapshots, new_reports_snapshots: INTEGER - число замеров за день с приростом > 0
+        
+        ### Table: daily_creator_stats (дневные агрегаты по креаторам)
+        - day: DATE, creator_id: BIGINT
+        - delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count: BIGINT - приращение за день по всем видео креатора
+        - videos_with_new_views, videos_with_new_likes, videos_with_new_comments, videos_with_new_reports: INTEGER - сколько видео креатора получили прирост за день
+        
+        ### Важные моменты:
+        1. video_snapshots.created_at - это время снятия снапшота (раз в час)
+        2. videos.video_created_at - это время публикации видео
+        3. delta_* поля показывают изменение за последний час
+        4. Для подсчета "прироста за день" нужно SUM(delta_*_count) из daily_video_stats за нужные дни
+        5. Для подсчета "сколько видео получали новые просмотры" за день нужно COUNT(*) из daily_video_stats WHERE new_views_snapshots > 0
+        6. Вопросы по дням отвечай из daily_video_stats / daily_creator_stats; video_snapshots нужна только для почасовых вопросов
+        """
+    
+    def _extract_date_range(self, text: str) -> Dict[str, str]:
+        """Извлечение дат из русского текста"""
+        for pattern, pattern_type in DATE_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                if pattern_type == 'single':
+                    day, month, year = match.groups()
+                    date_str = f"{year}-{MONTH_MAP[month.lower()]}-{int(day):02d}"
+                    return {'start_date': date_str, 'end_date': date_str}
+                elif pattern_type == 'range':
+                    day1, day2, month, year = match.groups()
+                    start_date = f"{year}-{MONTH_MAP[month.lower()]}-{int(day1):02d}"
+                    end_date = f"{year}-{MONTH_MAP[month.lower()]}-{int(day2):02d}"
+                    return {'start_date': start_date, 'end_date': end_date}
+        
+        return {'start_date': None, 'end_date': None}
+    
+    def _normalize_question(self, user_query: str, date_info: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+        """Нормализация вопроса для кэша: значения вынимаются в параметры"""
+        text = user_query.lower().replace('ё', 'е')
+        params: Dict[str, str] = {}
+        
+        if date_info['start_date']:
+            for pattern, pattern_type in DATE_PATTERNS:
+                text, replaced = pattern.subn(f' <{pattern_type}> ', text, count=1)
+                if replaced:
+                    break
+            if date_info['start_date'] == date_info['end_date']:
+                params['date'] = date_info['start_date']
+            else:
+                params['start_date'] = date_info['start_date']
+                params['end_date'] = date_info['end_date']
+        
+        match = CREATOR_ID_PATTERN.search(text)
+        if match:
+            params['creator_id'] = match.group(1)
+            text = f"{text[:match.start(1)]}<creator_id>{text[match.end(1):]}"
+        
+        def replace_number(number_match):
+            name = f"n{sum(1 for key in params if key.startswith('n'))}"
+            params[name] = re.sub(r'\s', '', number_match.group(0))
+            return f'<{name}>'
+        
+        text = NUMBER_PATTERN.sub(replace_number, text)
+        text = re.sub(r'[^\w<>\s]', ' ', text)
+        key = ' '.join(text.split())
+        return key, params
+    
+    def _build_static_prompt(self) -> str:
+        """Схема, правила и формат ответа - общий для всех вопросов префикс промпта"""
+        return compact_prompt(f"""
+        {SYSTEM_PROMPT}
+        
+        {self.schema_description}
+        
+        Преобразуй запрос пользователя в единственный SQL-запрос к PostgreSQL, который вернет ОДНО число.
+        
+        ### КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
+        1. Запрос должен возвращать ТОЛЬКО одно число (одно значение, одна колонка)
+        2. Используй правильные имена таблиц и колонок из схемы выше
+        3. Учитывай логику данных:
+           - Для подсчета видео используй таблицу `videos`
+           - Для подсчета прироста (просмотров, лайков и т.д.) используй `delta_*` поля: по дням - в `daily_video_stats` / `daily_creator_stats`, по часам - в `video_snapshots`
+           - Для фильтрации по дате публикации видео используй `videos.video_created_at`
+           - Для фильтрации по дате снятия снапшота используй `video_snapshots.created_at`
+        4. Если в запросе указана конкретная дата или период, добав соответствующие условия WHERE
+        5. Не добавляй LIMIT, OFFSET, ORDER BY если они не нужны для получения одного числа
+        6. Используй агрегатные функции: COUNT(), SUM(), AVG() когда нужно
+        7. Убедись, что JOIN выполняется правильно при работе с двумя таблицами
+        8. Не оборачивай колонки-даты в DATE() или ::date в WHERE: фильтруй полуоткрытым диапазоном col >= DATE 'начало' AND col < DATE 'следующий день после конца'
+        
+        Верни ТОЛЬКО SQL-запрос, без пояснений, без обратных кавычек, без markdown.
+        """)
+    
+    def _select_examples(self, question_key: str):
+        """Примеры, больше всего похожие на вопрос (коэффициент Жаккара по словам нормализованного вопроса)"""
+        words = set(question_key.split())
+        scored = []
+        for (question, sql), example_words in zip(FEW_SHOT_EXAMPLES, self._example_words):
+            score = len(words & example_words) / len(words | example_words) if words | example_words else 0
+            scored.append((score, question, sql))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        selected = [(question, sql) for score, question, sql in scored[:self.few_shot_examples] if score > 0]
+        return selected or [FEW_SHOT_EXAMPLES[0]]
+    
+    def _build_prompt(self, user_query: str, date_info: Dict[str, str]) -> str:
+        """Изменяемая часть промпта: похожие примеры, даты и сам вопрос (идет после static_prompt)"""
+        date_context = ""
+        if date_info['start_date']:
+            if date_info['start_date'] == date_info['end_date']:
+                date_context = f"Дата: {date_info['start_date']}"
+            else:
+                date_context = f"Период: с {date_info['start_date']} по {date_info['end_date']}"
+            end = next_day(date_info['end_date'])
+            if end is not None:
+                date_context += f" (следующий день после конца: {end})"
+        
+        question_key, _ = self._normalize_question(user_query, date_info)
+        examples = '\n'.join(
+            f'"{question}" → {sql}' for question, sql in self._select_examples(question_key)
+        )
+        
+        prompt = f"""
+        ### Примеры правильных SQL-запросов:
+        {examples}
+        
+        {date_context}
+        
+        Пользовательский запрос: "{user_query}"
+        SQL-запрос:
+        """
+        
+        return compact_prompt(prompt)
+    
+    def _chat_messages(self, prompt: str):
+        return [
+            {"role": "system", "content": self.static_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def _anthropic_system(self):
+        """Статический префикс с cache_control: Anthropic кэширует его между запросами"""
+        return [{"type": "text", "text": self.static_prompt, "cache_control": {"type": "ephemeral"}}]
+    
+    def _log_prompt_usage(self, prompt: str, usage: Any, provider: Optional[str] = None):
+        """Токены промпта по ответу провайдера (у OpenAI/Groq и Anthropic поля называются по-разному)"""
+        prompt_tokens = getattr(usage, 'prompt_tokens', None) or getattr(usage, 'input_tokens', None)
+        cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or \
+            getattr(usage, 'cache_read_input_tokens', None)
+        registry.inc('llm_prompt_tokens', prompt_tokens or 0, provider=provider or self.provider)
+        registry.inc('llm_cached_prompt_tokens', cached_tokens or 0, provider=provider or self.provider)
+        logger.info(
+            "LLM prompt (%s): %s tokens, cached %s; static %d chars, dynamic %d chars",
+            provider or self.provider, prompt_tokens, cached_tokens or 0, len(self.static_prompt), len(prompt),
+            extra={'provider': provider or self.provider, 'prompt_tokens': prompt_tokens, 'cached_tokens': cached_tokens}
+        )
+    
+    def question_key(self, user_query: str) -> str:
+        """Ключ вопроса: одинаковый у вопросов, которые отличаются только формой записи"""
+        key, params = self._normalize_question(user_query, self._extract_date_range(user_query))
+        return key + '|' + ','.join(f'{name}={value}' for name, value in sorted(params.items()))
+    
+    async def agenerate_sql(self, user_query: str) -> str:
+        """Асинхронная генерация SQL: не блокирует event loop на время ответа LLM"""
+        plan = await self.aplan_query(user_query)
+        return plan.literal_sql()
+    
+    def fast_plan(self, user_query: str) -> Optional[QueryPlan]:
+        """План только по правилам быстрого пути; None - вопрос правилами не распознан"""
+        cache_key, cache_params = self._normalize_question(user_query, self._extract_date_range(user_query))
+        intent = self.intent_parser.match(cache_key, cache_params)
+        return QueryPlan.from_intent(intent) if intent is not None else None
+    
+    async def aplan_query(self, user_query: str, fast_path: bool = True) -> QueryPlan:
+        """План запроса: правила быстрого пути, затем кэш, затем LLM, затем резервная логика
+        
+        fast_path=False - правила уже проверены через fast_plan, сразу кэш и LLM.
+        """
+        with registry.span('date_extraction'):
+            date_info = self._extract_date_range(user_query)
+            cache_key, cache_params = self._normalize_question(user_query, date_info)
+        
+        intent = self.intent_parser.match(cache_key, cache_params) if fast_path else None
+        if intent is not None:
+            registry.inc('plans', source='fast_path')
+            return QueryPlan.from_intent(intent)
+        
+        cached_sql = self.sql_cache.get(cache_key, cache_params)
+        if cached_sql:
+            registry.inc('plans', source='sql_cache')
+            return QueryPlan(cached_sql)
+        
+        with registry.span('prompt_build'):
+            prompt = self._build_prompt(user_query, date_info)
+        
+        try:
+            async with self._llm_semaphore:
+                provider, sql = await asyncio.wait_for(self.router.route(prompt), timeout=self.timeout)
+            logger.info("SQL generated by %s", provider)
+            registry.inc('plans', source='llm')
+            self.sql_cache.put(cache_key, sql, cache_params)
+            return QueryPlan(sql)
+        
+        except asyncio.TimeoutError:
+            logger.warning("LLM providers timed out after %ss", self.timeout)
+        except Exception as e:
+            logger.warning("LLM providers failed: %s", e)
+        registry.inc('plans', source='fallback')
+        return self._fallback_plan(user_query, date_info)
+    
+    async def _acall_provider(self, prompt: str, provider: Optional[str] = None) -> str:
+        """Вызов LLM через асинхронные клиенты провайдеров"""
+        provider = provider or self.provider
+        if provider == "openai":
+            client = self._get_async_client("openai")
+            response = await client.chat.completions.create(
+                model="gpt-4-turbo-preview",
+                messages=self._chat_messages(prompt),
+                temperature=0.1,
+                max_tokens=500
+            )
+            self._log_prompt_usage(prompt, response.usage, provider)
+            return response.choices[0].message.content.strip()
+        
+        elif provider == "anthropic":
+            client = self._get_async_client("anthropic")
+            response = await client.messages.create(
+                model="claude-3-opus-20240229",
+                max_tokens=500,
+                temperature=0.1,
+                system=self._anthropic_system(),
+                messages=[
+                    {"role": "user", "content": prompt}
+                ],
+                extra_headers=ANTHROPIC_CACHE_HEADERS
+            )
+            self._log_prompt_usage(prompt, response.usage, provider)
+            return response.content[0].text.strip()
+        
+        elif provider == "groq":
+            client = self._get_async_client("groq")
+            response = await client.chat.completions.create(
+                model="mixtral-8x7b-32768",
+                messages=self._chat_messages(prompt),
+                temperature=0.1,
+                max_tokens=500
+            )
+            self._log_prompt_usage(prompt, response.usage, provider)
+            return response.choices[0].message.content.strip()
+        
+        elif provider == "ollama":
+            session = self._get_async_client("ollama")
+            async with session.post(
+                settings.OLLAMA_URL,
+                json={
+                    "model": "codellama:13b",
+                    "system": self.static_prompt,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {"temperature": 0.1}
+                }
+            ) as response:
+                data = await response.json()
+                logger.info("LLM prompt (ollama): %s tokens", data.get('prompt_eval_count'))
+                return data["response"].strip()
+        
+        raise ValueError(f"Unsupported provider: {provider}")
+    
+    async def _acall_valid_sql(self, provider: str, prompt: str) -> str:
+        """Ответ провайдера, очищенный до SQL и прошедший проверку
+        
+        Отклоненный SQL один раз уходит тому же провайдеру вместе с причиной отказа;
+        второй отказ считается ошибкой провайдера.
+        """
+        response = await self._acall_provider(prompt, provider)
+        try:
+            return self._validated_sql(response)
+        except SQLValidationError as e:
+            registry.inc('sql_retries', provider=provider)
+            logger.info("SQL from %s rejected (%s), asking to fix it", provider, e)
+            response = await self._acall_provider(self._retry_prompt(prompt, response, e), provider)
+            return self._validated_sql(response)
+    
+    def _validated_sql(self, response: str) -> str:
+        with registry.span('sql_validation', step='llm_output'):
+            sql = self._clean_sql(response)
+            validator.validate(sql)
+        return sql
+    
+    def _retry_prompt(self, prompt: str, response: str, error: Exception) -> str:
+        """Промпт повтора: прежний вопрос, отклоненный ответ и причина; статическая часть та же и берется из кэша"""
+        return (
+            f"{prompt} {response.strip()}\n\n"
+            f"Этот запрос отклонен проверкой: {error}\n"
+            f"Исправь его: один SELECT только по таблицам {', '.join(settings.SQL_ALLOWED_TABLES)}.\n"
+            "SQL-запрос:"
+        )
+    
+    # SDK провайдеров (openai, anthropic, groq) и httpx импортируются при создании первого клиента:
+    # процесс загружает только те, что настроены, и не платит за остальные при старте
+    def _http_limits(self) -> "httpx.Limits":
+        """Параметры keep-alive пула из настроек"""
+        import httpx
+        return httpx.Limits(
+            max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY
+        )
+    
+    def _async_http_client(self, provider: str) -> "httpx.AsyncClient":
+        import httpx
+        client = httpx.AsyncClient(limits=self._http_limits(), timeout=self.timeout)
+        self._async_http[provider] = client
+        return client
+    
+    def _get_async_client(self, provider: str) -> Any:
+        """Асинхронный клиент провайдера, один на генератор"""
+        client = self._async_clients.get(provider)
+        if client is not None:
+            return client
+        
+        if provider == "ollama":
+            connector = aiohttp.TCPConnector(
+                limit=settings.LLM_POOL_MAX_CONNECTIONS,
+                keepalive_timeout=settings.LLM_POOL_KEEPALIVE_EXPIRY
+            )
+            client = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        elif provider == "openai":
+            import openai
+            client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=settings.OPENAI_BASE_URL,
+                                        http_client=self._async_http_client(provider))
+        elif provider == "anthropic":
+            from anthropic import AsyncAnthropic
+            client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"), base_url=settings.ANTHROPIC_BASE_URL,
+                                    http_client=self._async_http_client(provider))
+        elif provider == "groq":
+            import groq
+            client = groq.AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), base_url=settings.GROQ_BASE_URL,
+                                    http_client=self._async_http_client(provider))
+        else:
+            raise ValueError(f"Unsupported provider: {provider}")
+        
+        self._async_clients[provider] = client
+        return client
+    
+    async def warm_up(self):
+        """Подготовка к первому вопросу: SDK и клиенты провайдеров маршрутизатора и по соединению с их API
+        
+        Ошибки только пишутся в лог: недоступный сейчас провайдер не мешает запуску бота.
+        """
+        await asyncio.gather(*(self._preconnect(provider) for provider in self.router.providers))
+    
+    async def _preconnect(self, provider: str):
+        started = time.perf_counter()
+        try:
+            client = self._get_async_client(provider)
+            # Ответ не важен (хватит и 404): TCP/TLS-соединение остается в keep-alive пуле клиента
+            if provider == "ollama":
+                async with client.head(settings.OLLAMA_URL) as response:
+                    await response.read()
+            else:
+                await self._async_http[provider].head(str(client.base_url))
+            logger.info("LLM provider %s pre-connected in %.3fs", provider, time.perf_counter() - started)
+        except Exception as e:
+            logger.warning("Pre-connect to LLM provider %s failed: %s", provider, e)
+    
+    async def aclose(self):
+        """Закрытие клиентов и их HTTP-пулов"""
+        for provider, client in self._async_clients.items():
+            try:
+                # У aiohttp.ClientSession и у SDK-клиентов одинаковый close()
+                await client.close()
+            except Exception as e:
+                logger.warning("Failed to close %s client: %s", provider, e)
+        self._async_clients.clear()
+        self._async_http.clear()
+        self.sql_cache.save()
+        logger.info("LLM clients closed")
+    
+    def _clean_sql(self, sql: str) -> str:
+        """Очистка SQL от markdown и лишних символов"""
+        sql = sql.replace("```sql", "").replace("```", "").strip()
+        # Точка с запятой внутри строки или комментария запрос не обрывает
+        sql = first_statement(sql) + ';'
+        return self._rewrite_date_predicates(sql)
+    
+    def _rewrite_date_predicates(self, sql: str) -> str:
+        """DATE(col) = 'YYYY-MM-DD' -> полуоткрытый диапазон по col, чтобы работал индекс по col"""
+        def column(match) -> str:
+            return match.group('col1') or match.group('col2') or match.group('col3')
+        
+        # Граница "следующий день" - отдельный литерал, а не "+ 1": в шаблоне кэша это <<date_end>>.
+        # Несуществующую дату переписывать не из чего, ошибку вернет Postgres
+        def replace_between(match) -> str:
+            col, end = column(match), next_day(match.group('end'))
+            if end is None:
+                return match.group(0)
+            return f"({col} >= DATE '{match.group('start')}' AND {col} < DATE '{end}')"
+        
+        def replace_compare(match) -> str:
+            col, op, day = column(match), match.group('op'), match.group('date')
+            if op != '>=' and op != '<' and next_day(day) is None:
+                return match.group(0)
+            if op == '=':
+                return f"({col} >= DATE '{day}' AND {col} < DATE '{next_day(day)}')"
+            if op == '>=':
+                return f"{col} >= DATE '{day}'"
+            if op == '>':
+                return f"{col} >= DATE '{next_day(day)}'"
+            if op == '<':
+                return f"{col} < DATE '{day}'"
+            return f"{col} < DATE '{next_day(day)}'"
+        
+        sql = DATE_BETWEEN_PREDICATE.sub(replace_between, sql)
+        return DATE_COMPARE_PREDICATE.sub(replace_compare, sql)
+    
+    def _fallback_plan(self, user_query: str, date_info: Dict[str, str]) -> QueryPlan:
+        """Резервный план если LLM недоступна: лучший интент даже при неполном совпадении"""
+        key, params = self._normalize_question(user_query, date_info)
+        intent = self.intent_parser.parse(key, params)
+        if intent is not None:
+            return QueryPlan.from_intent(intent)
+        
+        # Дефолтный запрос
+        return QueryPlan("SELECT 'Запрос не распознан' as result;")
+    
+    def _fallback_sql_generation(self, user_query: str, date_info: Dict[str, str]) -> str:
+        """Резервная логика генерации SQL если LLM недоступна"""
+        return self._fallback_plan(user_query, date_info).literal_sql()
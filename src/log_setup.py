@@ -0,0 +1,35 @@
+import json
+import logging
+import sys
+
+
+# Атрибуты, которые есть у любой LogRecord; все остальное пришло через extra
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "text"):
+    """Настройка корневого логгера; сообщения форматируются только если запись проходит по уровню"""
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    logging.basicConfig(level=level.upper(), handlers=[handler], force=True)
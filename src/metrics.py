@@ -0,0 +1,160 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+
+# Границы корзин в секундах: от миллисекунды до десятков секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = "video_bot"
+
+# Этапы текущего запроса (bot.handle_text_query): задачи asyncio наследуют контекст и пишут в тот же список
+_request_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_stages', default=None)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как histogram в Prometheus)"""
+    
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+    
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        buckets[float('inf')] = self.count
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class MetricsRegistry:
+    """Гистограммы этапов, счетчики и gauge-коллекторы с выдачей в текстовом формате Prometheus"""
+    
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self.collectors: List[Callable[[], Dict[str, float]]] = []
+    
+    def histogram(self, stage: str, **labels: Any) -> Histogram:
+        key = (stage, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+    
+    def observe(self, stage: str, seconds: float, **labels: Any):
+        self.histogram(stage, **labels).observe(seconds)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, seconds))
+    
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        self.counters[(name, _labels(labels))] += value
+    
+    @contextmanager
+    def span(self, stage: str, **labels: Any):
+        """Замер этапа: with registry.span('prompt_build'): ..."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+    
+    def add_collector(self, collector: Callable[[], Dict[str, float]]):
+        """Функция, возвращающая текущие значения gauge (например, занятость пула)"""
+        self.collectors.append(collector)
+    
+    def render(self) -> str:
+        lines = [f'# TYPE {METRIC_PREFIX}_stage_seconds histogram']
+        for (stage, labels), histogram in sorted(self.histograms.items()):
+            labels = (('stage', stage),) + labels
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = _format_labels(labels, f'le="{bound}"')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{bucket_labels} {cumulative}')
+            bucket_labels = _format_labels(labels, 'le="+Inf"')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{bucket_labels} {histogram.count}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{_format_labels(labels)} {histogram.count}')
+        
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name}_total counter')
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f'{METRIC_PREFIX}_{name}_total{_format_labels(labels)} {value:g}')
+        
+        for collector in self.collectors:
+            for name, value in collector().items():
+                lines.append(f'# TYPE {METRIC_PREFIX}_{name} gauge')
+                lines.append(f'{METRIC_PREFIX}_{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def request_stages():
+    """Сбор этапов одного запроса пользователя: список (этап, секунды) в порядке завершения"""
+    stages: List[Tuple[str, float]] = []
+    token = _request_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _request_stages.reset(token)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный HTTP-сервер с /metrics (для режима polling и для каждого воркера вебхука)"""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+BUSY_MESSAGE = "⏳ Сейчас много запросов, попробуйте повторить вопрос через несколько секунд"
+
+
+class QueryLimitMiddleware(BaseMiddleware):
+    """Ограничение параллельных вопросов и склейка одинаковых вопросов в полете
+    
+    У одного пользователя одновременно обрабатывается не больше max_per_user
+    вопросов, у всех вместе - не больше max_total; сверх лимита сразу
+    отвечаем "занято". Если такой же вопрос (по key_func) уже считается,
+    новый не запускает LLM и БД заново, а ждет тот же результат: обработчик
+    получает в аргументе coalesce функцию, через которую выполняет расчет.
+    """
+    
+    def __init__(self, max_per_user: int, max_total: int, key_func: Callable[[str], str]):
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.key_func = key_func
+        self.active_total = 0
+        self.active_per_user: Dict[int, int] = defaultdict(int)
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.rejected = 0
+        self.coalesced = 0
+    
+    async def __call__(self, handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+                       event: Message, data: Dict[str, Any]) -> Any:
+        if not event.text or event.text.startswith('/') or event.from_user is None:
+            return await handler(event, data)
+    
+        user_id = event.from_user.id
+        key = self.key_func(event.text.strip())
+        # Присоединение к уже идущему расчету почти ничего не стоит: глобальный лимит на него не действует
+        joins_inflight = key in self.inflight
+        if self.active_per_user.get(user_id, 0) >= self.max_per_user or \
+                (not joins_inflight and self.active_total >= self.max_total):
+            self.rejected += 1
+            logger.info("Rejected query from user %s: concurrency limit reached", user_id)
+            await event.answer(BUSY_MESSAGE)
+            return None
+    
+        self.active_per_user[user_id] += 1
+        self.active_total += 1
+        data['coalesce'] = lambda compute: self._coalesce(key, compute)
+        try:
+            return await handler(event, data)
+        finally:
+            self.active_total -= 1
+            self.active_per_user[user_id] -= 1
+            if not self.active_per_user[user_id]:
+                del self.active_per_user[user_id]
+    
+    async def _coalesce(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Один расчет на ключ: остальные ждут его результат (или его исключение)"""
+        future = self.inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+    
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие; если их нет, не даем asyncio ругаться на непрочитанную ошибку
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.inflight[key]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active_total': self.active_total,
+            'active_users': len(self.active_per_user),
+            'inflight': len(self.inflight),
+            'rejected': self.rejected,
+            'coalesced': self.coalesced,
+        }
+
+
+class InFlightTracker(BaseMiddleware):
+    """Счетчик обрабатываемых апдейтов, чтобы при остановке дождаться начатых обработчиков"""
+    
+    def __init__(self):
+        self.active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+    
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+                       event: Any, data: Dict[str, Any]) -> Any:
+        self.active += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if not self.active:
+                self._idle.set()
+    
+    async def drain(self, timeout: float):
+        if not self.active:
+            return
+        logger.info("Waiting for %d in-flight updates", self.active)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown timeout: %d updates still in flight", self.active)
@@ -0,0 +1,280 @@
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Set
+
+from config import settings
+from metrics import registry
+
+
+class SQLValidationError(ValueError):
+    """SQL не прошел проверку; текст ошибки уходит в лог и обратно в LLM при повторе"""
+
+
+class Token(NamedTuple):
+    kind: str    # word, ident, string, number, param, op
+    value: str   # word - в нижнем регистре, ident - без кавычек
+    start: int
+
+
+TOKEN_PATTERN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\$(?P<tag>(?:[^\W\d]\w*)?)\$.*?\$(?P=tag)\$)
+    | (?P<ident>"(?:[^"]|"")+")
+    | (?P<param>\$\d+)
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[^\W\d]\w*)
+    | (?P<op>::|<=|>=|<>|!=|\|\||[-+*/%^<>=~!@#&|?(),;.\[\]:])
+""", re.VERBOSE | re.DOTALL)
+
+# Слова, которых не бывает в читающем SELECT: изменение данных и схемы, служебные команды, SELECT INTO
+FORBIDDEN_KEYWORDS = {
+    'insert', 'update', 'delete', 'merge', 'drop', 'truncate', 'alter', 'create', 'grant', 'revoke',
+    'copy', 'call', 'do', 'execute', 'prepare', 'deallocate', 'declare', 'vacuum', 'analyze', 'cluster',
+    'reindex', 'refresh', 'lock', 'listen', 'notify', 'unlisten', 'set', 'reset', 'discard', 'checkpoint',
+    'load', 'comment', 'into', 'share',
+}
+
+# Функции с побочными эффектами или доступом к серверу; pg_* - еще и системные каталоги
+FORBIDDEN_FUNCTIONS = {
+    'set_config', 'current_setting', 'nextval', 'setval', 'query_to_xml', 'table_to_xml', 'cursor_to_xml',
+}
+FORBIDDEN_PREFIXES = ('pg_', 'lo_', 'dblink')
+
+# Внутри этих функций FROM - часть синтаксиса аргументов, а не список таблиц
+FROM_ARGUMENT_FUNCTIONS = {'extract', 'substring', 'trim', 'overlay'}
+
+# Эти слова заканчивают список FROM: запятая после них - уже не следующая таблица
+FROM_END_KEYWORDS = {
+    'select', 'where', 'group', 'having', 'order', 'limit', 'offset', 'union', 'intersect', 'except',
+    'window', 'fetch', 'for', 'returning',
+}
+
+
+def iter_tokens(sql: str) -> Iterator[Token]:
+    """Токены SQL без пробелов и комментариев; строки, $$-строки и "идентификаторы" - целиком"""
+    pos = 0
+    while pos < len(sql):
+        match = TOKEN_PATTERN.match(sql, pos)
+        if match is None:
+            raise SQLValidationError(f"Не удалось разобрать SQL около символа {pos}: {sql[pos:pos + 20]!r}")
+        kind = match.lastgroup
+        text = match.group()
+        pos = match.end()
+        if kind in ('space', 'comment'):
+            continue
+        if kind == 'word':
+            text = text.lower()
+        elif kind == 'ident':
+            text = text[1:-1].replace('""', '"')
+        yield Token(kind, text, match.start())
+
+
+def tokenize(sql: str) -> List[Token]:
+    return list(iter_tokens(sql))
+
+
+def split_statements(tokens: Sequence[Token]) -> List[List[Token]]:
+    """Разбиение по ; вне строк и комментариев; пустые операторы отбрасываются"""
+    statements: List[List[Token]] = [[]]
+    for token in tokens:
+        if token.kind == 'op' and token.value == ';':
+            statements.append([])
+        else:
+            statements[-1].append(token)
+    return [statement for statement in statements if statement]
+
+
+def first_statement(sql: str) -> str:
+    """Текст до первой ; вне строк и комментариев (LLM часто дописывает пояснения после запроса)"""
+    try:
+        for token in iter_tokens(sql):
+            if token.kind == 'op' and token.value == ';':
+                return sql[:token.start].strip()
+    except SQLValidationError:
+        # Неразборчивый хвост оценит validate(), здесь текст не обрезается
+        pass
+    return sql.strip()
+
+
+def normalize_sql(sql: str) -> str:
+    """Ключ кэша решений: пробелы схлопываются, а переводы строк остаются - они заканчивают комментарий --"""
+    sql = re.sub(r'[ \t\r\f\v]+', ' ', sql)
+    sql = re.sub(r' ?\n\s*', '\n', sql)
+    return sql.strip()
+
+
+class SQLValidator:
+    """Проверка SQL по токенам: один читающий SELECT (или WITH ... SELECT) только по разрешенным таблицам
+    
+    Решение (принят или текст ошибки) кэшируется по нормализованному SQL: повторный запрос
+    из кэша SQL или от шаблона не разбирается заново.
+    """
+    
+    def __init__(self, allowed_tables: Sequence[str], cache_size: int = 1000):
+        self.allowed_tables = {table.lower() for table in allowed_tables}
+        self.cache_size = cache_size
+        self._verdicts: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def validate(self, sql: str):
+        """Бросает SQLValidationError, если запрос не проходит проверку"""
+        key = normalize_sql(sql)
+        if key in self._verdicts:
+            self._verdicts.move_to_end(key)
+            self.hits += 1
+            error = self._verdicts[key]
+        else:
+            self.misses += 1
+            try:
+                self._check(tokenize(sql))
+                error = None
+            except SQLValidationError as e:
+                error = str(e)
+            registry.inc('sql_verdicts', outcome='rejected' if error else 'ok')
+            if self.cache_size > 0:
+                self._verdicts[key] = error
+                while len(self._verdicts) > self.cache_size:
+                    self._verdicts.popitem(last=False)
+        
+        if error is not None:
+            raise SQLValidationError(error)
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._verdicts),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+    
+    def _check(self, tokens: List[Token]):
+        statements = split_statements(tokens)
+        if not statements:
+            raise SQLValidationError("Пустой запрос")
+        if len(statements) > 1:
+            raise SQLValidationError(f"Разрешен только один запрос, а их {len(statements)}")
+        tokens = statements[0]
+        
+        first = next((token for token in tokens if token.value != '('), tokens[0])
+        if first.kind != 'word' or first.value not in ('select', 'with'):
+            raise SQLValidationError(f"Разрешен только SELECT, а запрос начинается с {first.value.upper()}")
+        
+        ctes = self._cte_names(tokens)
+        # Для каждой открытой скобки - имя функции перед ней (или None)
+        calls: List[Optional[str]] = []
+        # Для каждого уровня скобок - идет ли на нем список FROM: там запятая открывает следующую таблицу,
+        # в том числе после подзапроса, табличной функции или JOIN ... ON
+        in_from: List[bool] = [False]
+        for i, token in enumerate(tokens):
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            is_call = following is not None and following.value == '(' and following.kind == 'op'
+            
+            if token.kind == 'op':
+                if token.value in ('(', '['):
+                    in_from.append(False)
+                elif token.value in (')', ']') and len(in_from) > 1:
+                    in_from.pop()
+                if token.value == '(':
+                    previous = tokens[i - 1] if i else None
+                    calls.append(previous.value if previous is not None and previous.kind == 'word' else None)
+                elif token.value == ')' and calls:
+                    calls.pop()
+                elif token.value == ',' and in_from[-1]:
+                    self._check_from_item(tokens, i + 1, ctes)
+                continue
+            
+            if token.kind not in ('word', 'ident'):
+                continue
+            
+            name = token.value.lower()
+            if token.kind == 'word' and name in FORBIDDEN_KEYWORDS:
+                raise SQLValidationError(f"Запрещенная операция: {name.upper()}")
+            if name.startswith(FORBIDDEN_PREFIXES) or (is_call and name in FORBIDDEN_FUNCTIONS):
+                raise SQLValidationError(f"Запрещено обращение к {token.value}")
+            
+            if token.kind == 'word' and name in FROM_END_KEYWORDS:
+                in_from[-1] = False
+            if token.kind == 'word' and name in ('from', 'join'):
+                if name == 'from' and calls and calls[-1] in FROM_ARGUMENT_FUNCTIONS:
+                    continue
+                if name == 'from' and self._is_distinct_from(tokens, i):
+                    continue
+                in_from[-1] = True
+                self._check_from_item(tokens, i + 1, ctes)
+    
+    @staticmethod
+    def _is_distinct_from(tokens: List[Token], i: int) -> bool:
+        """a IS [NOT] DISTINCT FROM b - сравнение, а не список таблиц"""
+        return i >= 2 and tokens[i - 1].value == 'distinct' and tokens[i - 2].value in ('is', 'not')
+    
+    @staticmethod
+    def _cte_names(tokens: List[Token]) -> Set[str]:
+        """Имена CTE: name [(колонки)] AS [[NOT] MATERIALIZED] ("""
+        names = set()
+        for i, token in enumerate(tokens):
+            if token.kind != 'word' or token.value != 'as':
+                continue
+            j = i + 1
+            while j < len(tokens) and tokens[j].value in ('not', 'materialized'):
+                j += 1
+            if j >= len(tokens) or tokens[j].value != '(' or i == 0:
+                continue
+            k = i - 1
+            if tokens[k].kind == 'op' and tokens[k].value == ')':
+                # name (колонки) AS (...)
+                depth = 0
+                while k >= 0:
+                    if tokens[k].kind == 'op' and tokens[k].value in '()':
+                        depth += 1 if tokens[k].value == ')' else -1
+                    k -= 1
+                    if depth == 0:
+                        break
+            if k >= 0 and tokens[k].kind in ('word', 'ident'):
+                names.add(tokens[k].value.lower())
+        return names
+    
+    def _check_from_item(self, tokens: List[Token], pos: int, ctes: Set[str]):
+        """Таблица после FROM, JOIN или запятой в списке FROM
+        
+        Подзапрос и аргументы табличной функции проверяет основной проход; следующие
+        элементы списка он же находит по запятым.
+        """
+        while pos < len(tokens) and tokens[pos].kind == 'word' and tokens[pos].value in ('lateral', 'only'):
+            pos += 1
+        if pos >= len(tokens):
+            raise SQLValidationError("После FROM/JOIN нет таблицы")
+        token = tokens[pos]
+        if token.kind == 'op' and token.value == '(':
+            return
+        if token.kind not in ('word', 'ident'):
+            raise SQLValidationError(f"Ожидалась таблица, а не {token.value!r}")
+        
+        parts = [token]
+        while (pos + 2 < len(tokens) and tokens[pos + 1].value == '.' and tokens[pos + 1].kind == 'op'
+               and tokens[pos + 2].kind in ('word', 'ident')):
+            pos += 2
+            parts.append(tokens[pos])
+        following = tokens[pos + 1] if pos + 1 < len(tokens) else None
+        if following is not None and following.kind == 'op' and following.value == '(':
+            # Табличная функция (generate_series, unnest); запрещенные отсекает основной проход
+            return
+        self._check_table(parts, ctes)
+    
+    def _check_table(self, parts: List[Token], ctes: Set[str]):
+        name = parts[-1].value if parts[-1].kind == 'ident' else parts[-1].value.lower()
+        schema = [part.value.lower() for part in parts[:-1]]
+        if schema and schema != ['public']:
+            raise SQLValidationError(f"Запрещена схема {'.'.join(schema)}")
+        if not schema and name in ctes:
+            return
+        if name not in self.allowed_tables:
+            raise SQLValidationError(
+                f"Таблица {name} недоступна, разрешены: {', '.join(sorted(self.allowed_tables))}"
+            )
+
+
+# Один валидатор на процесс: SQL, проверенный генератором, в Database берется из кэша решений
+validator = SQLValidator(settings.SQL_ALLOWED_TABLES, settings.SQL_VALIDATION_CACHE_SIZE)